@@ -0,0 +1,171 @@
+"""Fixed-layout shared-memory record carrying the latest battery status.
+
+The monitor publishes with a sequence counter: it is bumped to an odd value
+before the payload is written and to the next even value afterwards, so a
+reader that sees the same even value before and after copying the payload
+knows the copy is consistent. Readers never take a lock and only decode the
+payload when the counter has moved since their last read.
+
+A publisher may also poke a Unix datagram socket after each update so the
+display can wake immediately instead of waiting out its poll interval. The
+socket lives in Linux's abstract namespace, so there is no file for another
+user to create or squat on first, and the record file is only trusted if it
+belongs to us or root.
+"""
+
+import mmap
+import os
+import socket
+import struct
+from time import sleep
+
+BATTERY_SHM_PATH = '/dev/shm/battery'
+BATTERY_NOTIFY_PATH = '\0battery-notify'  # Abstract namespace, no file on disk
+
+VOLTAGE_LEVELS = ('off', 'one', 'two', 'three', 'four', 'five', 'six')
+
+SEQUENCE = struct.Struct('<I')
+# left, middle, right capacity digits, the voltage bar level index, flags and
+# the estimated minutes to empty.
+PAYLOAD = struct.Struct('<5BH')
+FLAG_STALE = 0x01
+FLAG_CHARGING = 0x02
+TIME_TO_EMPTY_UNKNOWN = 0xFFFF
+RECORD_SIZE = SEQUENCE.size + PAYLOAD.size
+READ_RETRIES = 8
+
+
+def check_owner(fd, path):
+    # /dev/shm is world-writable, so a record someone else created first
+    # could be forged or pulled out from under us.
+    owner = os.fstat(fd).st_uid
+    if owner not in (os.geteuid(), 0):
+        raise PermissionError(f'{path} is owned by uid {owner}, not by this user or root')
+
+
+class BatteryPublisher:
+    def __init__(self, path=BATTERY_SHM_PATH, notify_path=BATTERY_NOTIFY_PATH):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o644)
+        try:
+            check_owner(fd, path)
+            if os.fstat(fd).st_size < RECORD_SIZE:
+                os.ftruncate(fd, RECORD_SIZE)
+            self.map = mmap.mmap(fd, RECORD_SIZE)
+        finally:
+            os.close(fd)
+        # Resume from an existing counter so readers still see a change
+        # after the monitor restarts; round up past a half-finished write.
+        self.sequence = SEQUENCE.unpack_from(self.map, 0)[0]
+        self.sequence += self.sequence & 1
+        self.notify_path = notify_path
+        self.notify_socket = None
+        if notify_path:
+            self.notify_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.notify_socket.setblocking(False)
+
+    def publish(self, capacity_left_digit, capacity_middle_digit, capacity_right_digit, voltage_bar, stale=False,
+                charging=False, time_to_empty=None):
+        volts = VOLTAGE_LEVELS.index(voltage_bar) if voltage_bar in VOLTAGE_LEVELS else 0
+        flags = (FLAG_STALE if stale else 0) | (FLAG_CHARGING if charging else 0)
+        minutes = TIME_TO_EMPTY_UNKNOWN
+        if time_to_empty is not None:
+            minutes = min(int(time_to_empty // 60), TIME_TO_EMPTY_UNKNOWN - 1)
+        SEQUENCE.pack_into(self.map, 0, (self.sequence + 1) & 0xFFFFFFFF)
+        PAYLOAD.pack_into(self.map, SEQUENCE.size, capacity_left_digit, capacity_middle_digit,
+                          capacity_right_digit, volts, flags, minutes)
+        self.sequence = (self.sequence + 2) & 0xFFFFFFFF
+        SEQUENCE.pack_into(self.map, 0, self.sequence)
+        if self.notify_socket is not None:
+            try:
+                self.notify_socket.sendto(b'\x01', self.notify_path)
+            except OSError:
+                # Nobody is listening; readers still pick the record up on
+                # their next poll.
+                pass
+
+    def close(self):
+        self.map.close()
+        if self.notify_socket is not None:
+            self.notify_socket.close()
+
+
+class BatteryReader:
+    def __init__(self, path=BATTERY_SHM_PATH, notify_path=None):
+        self.path = path
+        self.map = None
+        self.sequence = None
+        self.notify_socket = None
+        if notify_path:
+            # A socket file left behind by an earlier reader has to go first;
+            # abstract names disappear with their socket.
+            if not notify_path.startswith('\0') and os.path.exists(notify_path):
+                os.unlink(notify_path)
+            self.notify_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            try:
+                self.notify_socket.bind(notify_path)
+            except OSError:
+                self.notify_socket.close()
+                raise
+
+    def open(self):
+        try:
+            fd = os.open(self.path, os.O_RDONLY | os.O_NOFOLLOW)
+        except FileNotFoundError:
+            return False
+        try:
+            check_owner(fd, self.path)
+            if os.fstat(fd).st_size < RECORD_SIZE:
+                return False
+            self.map = mmap.mmap(fd, RECORD_SIZE, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        return True
+
+    def read(self):
+        """Return the latest status dict, or None if nothing new was published."""
+        if self.map is None and not self.open():
+            return None
+        for _ in range(READ_RETRIES):
+            before = SEQUENCE.unpack_from(self.map, 0)[0]
+            if before == self.sequence:
+                return None
+            if before & 1:
+                sleep(0)
+                continue
+            left, middle, right, volts, flags, minutes = PAYLOAD.unpack_from(self.map, SEQUENCE.size)
+            if SEQUENCE.unpack_from(self.map, 0)[0] != before:
+                continue
+            self.sequence = before
+            if before == 0:
+                # Never published.
+                return None
+            return {
+                'left': left,
+                'middle': middle,
+                'right': right,
+                'volts': VOLTAGE_LEVELS[volts] if volts < len(VOLTAGE_LEVELS) else 'off',
+                'stale': bool(flags & FLAG_STALE),
+                'charging': bool(flags & FLAG_CHARGING),
+                # Seconds, or None while not discharging.
+                'time_to_empty': None if minutes == TIME_TO_EMPTY_UNKNOWN else minutes * 60,
+            }
+        return None
+
+    def wait(self, timeout):
+        """Block until the publisher signals an update or timeout expires."""
+        if self.notify_socket is None:
+            sleep(timeout)
+            return False
+        self.notify_socket.settimeout(timeout)
+        try:
+            self.notify_socket.recv(16)
+        except (socket.timeout, BlockingIOError):
+            # A zero timeout makes the socket non-blocking.
+            return False
+        return True
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        if self.notify_socket is not None:
+            self.notify_socket.close()
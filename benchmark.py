@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""Scan-rate benchmark for LEDDisplay.update_display on the simulated GPIO backend.
+
+Usage: python benchmark.py [--duration SECONDS] [--frame-rate HZ] [--brightness LEVEL]
+"""
+
+import argparse
+import statistics
+from time import perf_counter
+
+import gpio_backend
+from scan_scheduler import ScanScheduler
+from screen import LEDDisplay
+
+# Representative display states, as widget -> value overrides.
+STATES = {
+    'zeros': {},
+    'typical': {
+        'voltage_bar': 'four', 'capacity_middle_digit': 8, 'capacity_right_digit': 7, 'misc_lights': 'on',
+        'usage_arrow': 'norm', 'temp_middle_digit': 4, 'temp_right_digit': 5, 'ram_bar': 'three',
+    },
+    'all_eights': {
+        'voltage_bar': 'six', 'capacity_left_digit': 1, 'capacity_middle_digit': 8, 'capacity_right_digit': 8,
+        'misc_lights': 'on', 'usage_arrow': 'turbo', 'temp_left_digit': 1, 'temp_middle_digit': 8,
+        'temp_right_digit': 8, 'ram_bar': 'six',
+    },
+}
+
+
+def run_state(name, values, duration, frame_rate, brightness):
+    gpio = gpio_backend.SimulatedGPIOBackend()
+    display = LEDDisplay(gpio=gpio)
+    display.scheduler = ScanScheduler(10**9 // frame_rate, display.scheduler.slots)
+    # Same timer slack and spin as the scan thread in update_display.
+    display.scheduler.bind_thread()
+    display.set_brightness(brightness)
+    display.update_state(**values)
+
+    # The first frame compiles the scan plan; keep it out of the numbers.
+    display.render_frame()
+    gpio.reset_stats()
+    missed = display.scheduler.missed_deadlines
+
+    frame_times = []
+    start = perf_counter()
+    last = start
+    while last - start < duration:
+        display.render_frame()
+        now = perf_counter()
+        frame_times.append(now - last)
+        last = now
+    gpio.update_lit()
+
+    frames = len(frame_times)
+    elapsed = last - start
+    on_times = [total / frames * 1e6 for total in gpio.on_time.values()]
+    return {
+        'state': name,
+        'segments': len(display.current_segments(display.state)),
+        'fps': frames / elapsed,
+        'calls_per_frame': gpio.calls / frames,
+        'on_time_us': statistics.mean(on_times) if on_times else 0.0,
+        'on_time_min_us': min(on_times, default=0.0),
+        'on_time_max_us': max(on_times, default=0.0),
+        'jitter_us': statistics.pstdev(frame_times) * 1e6,
+        'missed': display.scheduler.missed_deadlines - missed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=2.0, help='seconds to run each display state')
+    parser.add_argument('--frame-rate', type=int, default=LEDDisplay.FRAME_RATE,
+                        help='target frames/sec; set it unreachably high to measure raw scan-loop throughput')
+    parser.add_argument('--brightness', type=float, default=1.0, help='global PWM duty cycle, 0.0 to 1.0')
+    args = parser.parse_args()
+
+    print(f"{'state':<12}{'segs':>6}{'fps':>12}{'calls/frame':>13}{'on-time us (min/avg/max)':>28}{'jitter us':>12}{'missed':>8}")
+    for name, values in STATES.items():
+        r = run_state(name, values, args.duration, args.frame_rate, args.brightness)
+        on_time = f"{r['on_time_min_us']:.1f}/{r['on_time_us']:.1f}/{r['on_time_max_us']:.1f}"
+        print(f"{r['state']:<12}{r['segments']:>6}{r['fps']:>12.1f}{r['calls_per_frame']:>13.1f}{on_time:>28}{r['jitter_us']:>12.1f}{r['missed']:>8}")
+
+
+if __name__ == '__main__':
+    main()
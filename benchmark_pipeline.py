@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""End-to-end sensor-to-display benchmark on a replayed sensor trace.
+
+Usage: python benchmark_pipeline.py [--trace PATH] [--speed N] [--duration SECONDS]
+                                    [--throughput-speed N]
+
+Latency runs the daemon's battery and metrics tasks against a ReplaySource.
+It measures how long after a reading becomes visible in the trace the display
+state shows it, for the temperature and capacity digits, which map directly
+from one reading. Throughput replays as fast as the pipeline can consume
+readings. Without --trace a synthetic discharge trace is generated.
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import os
+import statistics
+import tempfile
+from threading import Event, Thread
+from time import perf_counter, sleep, time
+
+import daemon
+import gpio_backend
+from monitor import BatteryMonitor, BatteryTracker, prepare_readCapacity
+from screen import LEDDisplay
+from sensors import ReplaySource, TraceWriter
+from sysmetrics import SystemSampler
+from telemetry import TelemetryHistory
+
+
+def synthesize_trace(path, seconds=3600, period=0.5):
+    """Write an hour of readings: a slow discharge, wandering temperature and CPU load."""
+    writer = TraceWriter(path)
+    start = time()
+    idle = total = 0
+    steps = int(seconds / period)
+    for step in range(steps):
+        timestamp = start + step * period
+        writer.write(timestamp, 'temperature', (int(50000 + 8000 * math.sin(step / 40)),))
+        total += 100
+        idle += int(50 + 45 * math.sin(step / 7))
+        writer.write(timestamp, 'cpu', (idle, total))
+        writer.write(timestamp, 'ram', (1000000, int(500000 + 300000 * math.sin(step / 90))))
+        capacity = 95 - 90 * step / steps
+        vcell = int((3.35 + 0.35 * capacity / 100) * 16000 / 1.25)
+        writer.write(timestamp, 'battery', (vcell, int(capacity * 256)))
+    writer.close()
+
+
+def temperature_digits(values):
+    temp = int(values[0] / 1000)
+    return temp // 100, temp // 10 % 10, temp % 10
+
+
+def capacity_digits(values):
+    return prepare_readCapacity(round(values[1] / 256))
+
+
+# channel -> (DisplayState fields, reading -> expected field values)
+TRACKED = {
+    'temperature': (('temp_left_digit', 'temp_middle_digit', 'temp_right_digit'), temperature_digits),
+    'battery': (('capacity_left_digit', 'capacity_middle_digit', 'capacity_right_digit'), capacity_digits),
+}
+
+
+def watch_state(display, snapshots, stop):
+    # Poll rather than hook update_state so the pipeline runs unmodified.
+    version = None
+    while not stop.is_set():
+        state = display.state
+        if state.version != version:
+            version = state.version
+            snapshots.append((perf_counter(), state))
+        sleep(0.0002)
+
+
+async def drive_pipeline(display, tracker, sampler, duration):
+    statuses = asyncio.Queue(maxsize=1)
+    tasks = [
+        asyncio.create_task(daemon.poll_battery(display, tracker, statuses)),
+        asyncio.create_task(daemon.collect_metrics(display, sampler)),
+    ]
+    await asyncio.sleep(duration)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure_latency(trace_path, speed, duration, workdir):
+    source = ReplaySource(trace_path, speed, clock=perf_counter)
+    gpio = gpio_backend.SimulatedGPIOBackend()
+    display = LEDDisplay(gpio=gpio)
+    history = TelemetryHistory(os.path.join(workdir, 'history.bin'))
+    tracker = BatteryTracker(BatteryMonitor(source=source), history, gpio)
+    sampler = SystemSampler(LEDDisplay.METRIC_INTERVALS, source=source)
+    snapshots = []
+    stop = Event()
+    watcher = Thread(target=watch_state, args=(display, snapshots, stop), daemon=True)
+    watcher.start()
+    try:
+        asyncio.run(drive_pipeline(display, tracker, sampler, duration))
+    finally:
+        stop.set()
+        watcher.join()
+        history.close()
+    end = perf_counter()
+
+    results = {}
+    for channel, (fields, expected_for) in TRACKED.items():
+        latencies = []
+        superseded = 0
+        changes = []
+        previous = None
+        for timestamp, record_channel, values, error in source.records:
+            if record_channel != channel or error:
+                continue
+            expected = expected_for(values)
+            visible = source.visible_at(timestamp)
+            if visible > end:
+                break
+            if expected != previous:
+                changes.append((visible, expected))
+                previous = expected
+        for index, (visible, expected) in enumerate(changes):
+            next_change = changes[index + 1][0] if index + 1 < len(changes) else end
+            for seen, state in snapshots:
+                if seen >= visible and tuple(getattr(state, field) for field in fields) == expected:
+                    if seen <= next_change:
+                        latencies.append(seen - visible)
+                    else:
+                        superseded += 1
+                    break
+            else:
+                superseded += 1
+        results[channel] = (latencies, superseded)
+    return results
+
+
+def measure_throughput(trace_path, speed, duration, workdir):
+    # Every metric due on every cycle, so the pipeline runs flat out. Recorded
+    # fuel gauge errors fail straight away rather than sleeping through retries.
+    source = ReplaySource(trace_path, speed, clock=perf_counter)
+    display = LEDDisplay(gpio=gpio_backend.SimulatedGPIOBackend())
+    history = TelemetryHistory(os.path.join(workdir, 'throughput_history.bin'))
+    tracker = BatteryTracker(BatteryMonitor(source=source, retries=0), history)
+    sampler = SystemSampler({'temperature': 0, 'cpu': 0, 'ram': 0}, source=source)
+    start = perf_counter()
+    start_version = display.state.version
+    trace_start = source.now()
+    cycles = 0
+    # One log line per replayed read error would swamp both output and timing.
+    logging.disable(logging.ERROR)
+    try:
+        while perf_counter() - start < duration and not source.finished():
+            display.refresh_metrics(sampler)
+            status = tracker.poll()
+            if status is not None:
+                display.apply_battery(status.as_dict())
+            cycles += 1
+    finally:
+        logging.disable(logging.NOTSET)
+        history.close()
+    elapsed = perf_counter() - start
+    return {
+        'cycles_per_sec': cycles / elapsed,
+        # Three metric reads plus the fuel gauge per cycle.
+        'readings_per_sec': cycles * 4 / elapsed,
+        'state_updates_per_sec': (display.state.version - start_version) / elapsed,
+        'trace_seconds_per_sec': (min(source.now(), source.trace_end) - trace_start) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--trace', help='sensor trace recorded with SENSOR_TRACE; synthesized if omitted')
+    parser.add_argument('--speed', type=float, default=10.0, help='replay speed-up for the latency run')
+    parser.add_argument('--duration', type=float, default=10.0, help='wall-clock seconds for each run')
+    parser.add_argument('--throughput-speed', type=float, default=1000.0,
+                        help='replay speed-up for the throughput run')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        trace_path = args.trace
+        if trace_path is None:
+            trace_path = os.path.join(workdir, 'synthetic.trace')
+            synthesize_trace(trace_path)
+
+        print(f'latency at {args.speed:g}x replay, {args.duration:g}s:')
+        print(f"{'channel':<14}{'changes':>9}{'superseded':>12}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+        for channel, (latencies, superseded) in measure_latency(trace_path, args.speed, args.duration,
+                                                                workdir).items():
+            if latencies:
+                stats = (statistics.median(latencies) * 1e3, percentile(latencies, 0.95) * 1e3, max(latencies) * 1e3)
+            else:
+                stats = (math.nan,) * 3
+            print(f"{channel:<14}{len(latencies):>9}{superseded:>12}{stats[0]:>10.1f}{stats[1]:>10.1f}{stats[2]:>10.1f}")
+
+        r = measure_throughput(trace_path, args.throughput_speed, args.duration, workdir)
+        print(f'\nthroughput at {args.throughput_speed:g}x replay:')
+        print(f"  {r['cycles_per_sec']:.0f} pipeline cycles/s, {r['readings_per_sec']:.0f} readings/s, "
+              f"{r['state_updates_per_sec']:.0f} state updates/s, {r['trace_seconds_per_sec']:.0f} trace s/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""Single-process replacement for running monitor.py and screen.py side by side.
+
+Battery polling, system metrics collection and status publishing run as
+asyncio tasks that hand data to the display in memory. The timing-critical
+scan loop keeps its own thread. This process is the only GPIO owner, so it
+sets the pin mode once and cleans up once on exit.
+"""
+
+import asyncio
+import logging
+import signal
+from threading import Thread
+
+import gpio_backend
+import monitor
+import sensors
+from battery_channel import BatteryPublisher
+from instrumentation import serve
+from monitor import BatteryMonitor, BatteryTracker, send_status
+from screen import LEDDisplay
+from sysmetrics import SystemSampler
+from telemetry import TelemetryHistory
+
+
+async def poll_battery(display, tracker, statuses):
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    # Edge callbacks arrive on the GPIO library's thread.
+    monitor.setup_charging_detect(tracker.gpio, lambda channel: loop.call_soon_threadsafe(wake.set))
+
+    while True:
+        wake.clear()
+        # The I2C read and its retry backoff block, so keep them off the loop.
+        status = await asyncio.to_thread(tracker.poll)
+        if status is not None:
+            display.apply_battery(status.as_dict())
+            # Only the newest status is worth publishing.
+            if statuses.full():
+                statuses.get_nowait()
+            statuses.put_nowait(status)
+        try:
+            await asyncio.wait_for(wake.wait(), tracker.interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def collect_metrics(display, sampler):
+    while True:
+        await asyncio.sleep(display.refresh_metrics(sampler))
+
+
+async def publish_status(publisher, statuses):
+    # Keeps the shared-memory record and JSON export current for any
+    # external readers; the display itself is fed directly.
+    while True:
+        status = await statuses.get()
+        try:
+            send_status(status, publisher)
+        except Exception as e:
+            logging.error("An error occurred while publishing status: %s", e)
+
+
+async def run(gpio, source=None):
+    if source is None:
+        source = sensors.get_source()
+    # LEDDisplay.setup_gpio sets the pin mode, before any task touches the pins.
+    display = LEDDisplay(gpio=gpio)
+    history = TelemetryHistory()
+    tracker = BatteryTracker(BatteryMonitor(source=source), history, gpio)
+    sampler = SystemSampler(LEDDisplay.METRIC_INTERVALS, source=source)
+    publisher = BatteryPublisher(notify_path=None)
+    statuses = asyncio.Queue(maxsize=1)
+
+    scan_thread = Thread(target=display.update_display, name='scan', daemon=True)
+    scan_thread.start()
+
+    tasks = [
+        asyncio.create_task(poll_battery(display, tracker, statuses)),
+        asyncio.create_task(collect_metrics(display, sampler)),
+        asyncio.create_task(publish_status(publisher, statuses)),
+    ]
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, lambda: [task.cancel() for task in tasks])
+    try:
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        display.stop_event.set()
+        scan_thread.join(timeout=1)
+        # LEDDisplay.stop clears the segments and runs the one GPIO cleanup.
+        display.stop()
+        source.close()
+        publisher.close()
+        history.close()
+        logging.info("GPIO cleanup complete.")
+
+
+def main(gpio=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    if gpio is None:
+        gpio = gpio_backend.get_backend()
+    # Same port as the standalone monitor, which this process replaces.
+    serve(monitor.METRICS_PORT)
+    asyncio.run(run(gpio))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+import os
+from time import perf_counter
+
+# Constant values match RPi.GPIO so callers can mix backends freely.
+IN = 1
+OUT = 0
+HIGH = 1
+LOW = 0
+BCM = 11
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+
+class GPIOBackend:
+    IN = IN
+    OUT = OUT
+    HIGH = HIGH
+    LOW = LOW
+    BCM = BCM
+    RISING = RISING
+    FALLING = FALLING
+    BOTH = BOTH
+
+    def setmode(self, mode):
+        raise NotImplementedError
+
+    def setwarnings(self, flag):
+        raise NotImplementedError
+
+    def setup(self, channel, direction, initial=None):
+        raise NotImplementedError
+
+    def output(self, channel, value):
+        raise NotImplementedError
+
+    def input(self, channel):
+        raise NotImplementedError
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        raise NotImplementedError
+
+    def remove_event_detect(self, channel):
+        raise NotImplementedError
+
+    def cleanup(self):
+        raise NotImplementedError
+
+
+class RPiGPIOBackend(GPIOBackend):
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.gpio = GPIO
+        # Bind straight to the module functions so the hot path pays no
+        # extra Python call per GPIO operation.
+        self.setmode = GPIO.setmode
+        self.setwarnings = GPIO.setwarnings
+        self.output = GPIO.output
+        self.input = GPIO.input
+        self.remove_event_detect = GPIO.remove_event_detect
+        self.cleanup = GPIO.cleanup
+
+    def setup(self, channel, direction, initial=None):
+        if initial is None:
+            self.gpio.setup(channel, direction)
+        else:
+            self.gpio.setup(channel, direction, initial=initial)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        if bouncetime is None:
+            self.gpio.add_event_detect(channel, edge, callback=callback)
+        else:
+            self.gpio.add_event_detect(channel, edge, callback=callback, bouncetime=bouncetime)
+
+
+class SimulatedGPIOBackend(GPIOBackend):
+    """In-memory pin model that also tracks how long each segment is lit.
+
+    A segment (pin_high, pin_low) is lit while pin_high is driven HIGH and
+    pin_low is driven LOW.
+    """
+
+    def __init__(self):
+        self.mode = None
+        self.directions = {}
+        self.levels = {}
+        self.calls = 0
+        self.inputs = {}
+        self.event_callbacks = {}
+        self.on_time = {}
+        self.lit = ()
+        self.lit_since = perf_counter()
+
+    def setmode(self, mode):
+        self.calls += 1
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        self.calls += 1
+
+    def setup(self, channel, direction, initial=None):
+        self.calls += 1
+        self.directions[channel] = direction
+        if direction == OUT:
+            self.levels[channel] = LOW if initial is None else initial
+        else:
+            self.levels.pop(channel, None)
+        self.update_lit()
+
+    def output(self, channel, value):
+        self.calls += 1
+        if self.directions.get(channel) != OUT:
+            raise RuntimeError('The GPIO channel has not been set up as an OUTPUT')
+        self.levels[channel] = value
+        self.update_lit()
+
+    def input(self, channel):
+        self.calls += 1
+        if self.directions.get(channel) == OUT:
+            return self.levels[channel]
+        return self.inputs.get(channel, LOW)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        self.calls += 1
+        self.event_callbacks[channel] = (edge, callback)
+
+    def remove_event_detect(self, channel):
+        self.calls += 1
+        self.event_callbacks.pop(channel, None)
+
+    def cleanup(self):
+        self.calls += 1
+        self.directions.clear()
+        self.levels.clear()
+        self.event_callbacks.clear()
+        self.update_lit()
+
+    def set_input(self, channel, level):
+        """Simulate an external signal on an input pin, firing edge callbacks."""
+        previous = self.inputs.get(channel, LOW)
+        self.inputs[channel] = level
+        edge, callback = self.event_callbacks.get(channel, (None, None))
+        if callback is None or level == previous:
+            return
+        if edge == BOTH or edge == (RISING if level == HIGH else FALLING):
+            callback(channel)
+
+    def update_lit(self):
+        now = perf_counter()
+        elapsed = now - self.lit_since
+        for segment in self.lit:
+            self.on_time[segment] = self.on_time.get(segment, 0.0) + elapsed
+        high = [pin for pin, level in self.levels.items() if level == HIGH]
+        low = [pin for pin, level in self.levels.items() if level == LOW]
+        self.lit = tuple((pin_high, pin_low) for pin_high in high for pin_low in low)
+        self.lit_since = now
+
+    def reset_stats(self):
+        self.update_lit()
+        self.calls = 0
+        self.on_time = {}
+
+
+class RecordingGPIOBackend(GPIOBackend):
+    """Forwards every call to another backend and keeps a timestamped log."""
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else SimulatedGPIOBackend()
+        self.records = []
+
+    def record(self, name, *args):
+        self.records.append((perf_counter(), name, args))
+
+    def setmode(self, mode):
+        self.record('setmode', mode)
+        self.backend.setmode(mode)
+
+    def setwarnings(self, flag):
+        self.record('setwarnings', flag)
+        self.backend.setwarnings(flag)
+
+    def setup(self, channel, direction, initial=None):
+        self.record('setup', channel, direction, initial)
+        self.backend.setup(channel, direction, initial=initial)
+
+    def output(self, channel, value):
+        self.record('output', channel, value)
+        self.backend.output(channel, value)
+
+    def input(self, channel):
+        self.record('input', channel)
+        return self.backend.input(channel)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        self.record('add_event_detect', channel, edge, bouncetime)
+        self.backend.add_event_detect(channel, edge, callback=callback, bouncetime=bouncetime)
+
+    def remove_event_detect(self, channel):
+        self.record('remove_event_detect', channel)
+        self.backend.remove_event_detect(channel)
+
+    def cleanup(self):
+        self.record('cleanup')
+        self.backend.cleanup()
+
+
+BACKENDS = {
+    'rpi': RPiGPIOBackend,
+    'sim': SimulatedGPIOBackend,
+    'recording': RecordingGPIOBackend,
+}
+
+
+def get_backend(name=None):
+    # GPIO_BACKEND lets the scripts run off-device, e.g. GPIO_BACKEND=sim.
+    name = name or os.environ.get('GPIO_BACKEND', 'rpi')
+    return BACKENDS[name]()
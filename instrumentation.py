@@ -0,0 +1,134 @@
+"""Low-overhead counters and histograms served in Prometheus text format.
+
+Recording is a plain attribute increment (plus a bisect for histograms) with
+no locking, so it is cheap enough for the scan loop. Under concurrent writers
+an occasional increment may be lost, which is acceptable for monitoring.
+Values that already live elsewhere, like the scheduler's frame count, are
+registered as callbacks and only read when the endpoint is scraped.
+"""
+
+import logging
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+METRICS_HOST = '127.0.0.1'
+
+
+class Counter:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def render(self):
+        return [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} counter',
+            f'{self.name} {self.value}',
+        ]
+
+
+class Histogram:
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.bounds = tuple(sorted(buckets))
+        # One slot per bucket plus the +Inf overflow.
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} histogram',
+        ]
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative + self.counts[-1]}')
+        lines.append(f'{self.name}_sum {self.sum}')
+        lines.append(f'{self.name}_count {self.count}')
+        return lines
+
+
+class Callback:
+    def __init__(self, name, description, kind, read):
+        self.name = name
+        self.description = description
+        self.kind = kind
+        self.read = read
+
+    def render(self):
+        return [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} {self.kind}',
+            f'{self.name} {self.read()}',
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def counter(self, name, description):
+        return self.metrics.setdefault(name, Counter(name, description))
+
+    def histogram(self, name, description, buckets):
+        return self.metrics.setdefault(name, Histogram(name, description, buckets))
+
+    def callback(self, name, description, read, kind='gauge'):
+        # Re-registering replaces the old callback, e.g. for a new display.
+        self.metrics[name] = Callback(name, description, kind, read)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logging.error("Error rendering metric %s: %s", metric.name, e)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host=METRICS_HOST):
+    """Serve /metrics over HTTP on a background thread; returns the server or None."""
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logging.warning("Could not start metrics endpoint on %s:%s: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
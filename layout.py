@@ -0,0 +1,251 @@
+"""Declarative description of the charlieplexed LED display and its compiler.
+
+Each widget names its pins once: a digit gives its common (low) pin and the
+pin behind each of its seven-segment letters, a bar its common pin and the
+pins lit level by level, and an indicator the pin pairs for each state.
+Digits share the GLYPHS bitmask table. compile_layout() turns the description
+into flat tuples of (high pin, low pin) pairs indexed by widget and value,
+and rejects descriptions where one pin pair would drive two different LEDs.
+Compiling takes a few hundred microseconds, less than reading and
+re-checking a cached copy, so load() compiles on every start by default. It
+can still cache to LAYOUT_CACHE_PATH, keyed by a hash of the description and
+COMPILER_VERSION, and checks cached tables before using them.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from collections import namedtuple
+
+from battery_channel import VOLTAGE_LEVELS
+
+PINS = {
+    'Pin1': 17, 'Pin2': 27, 'Pin3': 22, 'Pin4': 23, 'Pin5': 24, 'Pin6': 25, 'Pin7': 13, 'Pin8': 16,
+}
+
+# Seven-segment glyphs over segments a-g, bit 0 = a.
+SEGMENTS = 'abcdefg'
+GLYPHS = {
+    0: 0b0111111,
+    1: 0b0000110,
+    2: 0b1011011,
+    3: 0b1001111,
+    4: 0b1100110,
+    5: 0b1101101,
+    6: 0b1111101,
+    7: 0b0000111,
+    8: 0b1111111,
+    9: 0b1101111,
+}
+
+DIGIT_SEGMENTS = ('a', 'b', 'c', 'd', 'e', 'f', 'g')
+
+# Widgets in scan order. The first value of each widget is its initial value.
+LAYOUT = {
+    'voltage_bar': {
+        'type': 'bar', 'common': 'Pin8', 'pins': ('Pin1', 'Pin2', 'Pin3', 'Pin4', 'Pin7', 'Pin5'),
+        'levels': VOLTAGE_LEVELS,
+    },
+    # Hundreds digits only wire b and c, showing a blank for 0 and a 1.
+    'capacity_left_digit': {
+        'type': 'digit', 'common': 'Pin7', 'segments': {'b': 'Pin2', 'c': 'Pin3'}, 'values': (0, 1),
+        'blank_zero': True,
+    },
+    'capacity_middle_digit': {
+        'type': 'digit', 'common': 'Pin1',
+        'segments': dict(zip(DIGIT_SEGMENTS, ('Pin2', 'Pin3', 'Pin4', 'Pin8', 'Pin7', 'Pin5', 'Pin6'))),
+        'values': tuple(range(10)),
+    },
+    'capacity_right_digit': {
+        'type': 'digit', 'common': 'Pin2',
+        'segments': dict(zip(DIGIT_SEGMENTS, ('Pin1', 'Pin3', 'Pin4', 'Pin8', 'Pin7', 'Pin5', 'Pin6'))),
+        'values': tuple(range(10)),
+    },
+    'misc_lights': {
+        'type': 'indicator',
+        'states': {
+            'off': (),
+            'on': (('Pin6', 'Pin8'), ('Pin1', 'Pin7'), ('Pin1', 'Pin5'), ('Pin8', 'Pin5'), ('Pin2', 'Pin5'),
+                   ('Pin7', 'Pin5'), ('Pin5', 'Pin6')),
+        },
+    },
+    'usage_arrow': {
+        'type': 'indicator',
+        'states': {
+            'off': (),
+            'turbo': (('Pin3', 'Pin5'),),
+            'norm': (('Pin4', 'Pin5'),),
+        },
+    },
+    'temp_left_digit': {
+        'type': 'digit', 'common': 'Pin7', 'segments': {'b': 'Pin5', 'c': 'Pin8'}, 'values': (0, 1),
+        'blank_zero': True,
+    },
+    'temp_middle_digit': {
+        'type': 'digit', 'common': 'Pin3',
+        'segments': dict(zip(DIGIT_SEGMENTS, ('Pin1', 'Pin2', 'Pin4', 'Pin8', 'Pin7', 'Pin5', 'Pin6'))),
+        'values': tuple(range(10)),
+    },
+    'temp_right_digit': {
+        'type': 'digit', 'common': 'Pin4',
+        'segments': dict(zip(DIGIT_SEGMENTS, ('Pin1', 'Pin2', 'Pin3', 'Pin8', 'Pin7', 'Pin5', 'Pin6'))),
+        'values': tuple(range(10)),
+    },
+    'ram_bar': {
+        'type': 'bar', 'common': 'Pin6', 'pins': ('Pin1', 'Pin2', 'Pin3', 'Pin4', 'Pin8', 'Pin7'),
+        'levels': VOLTAGE_LEVELS,
+    },
+}
+
+# Path of an optional cache of the compiled tables. Off by default, since
+# compiling is cheaper than loading and checking the cache.
+LAYOUT_CACHE_PATH = None
+# Bump whenever widget_elements or compile_layout change what they produce.
+COMPILER_VERSION = 1
+
+# values[i] lists widget i's values; segments[i][n] holds the (high, low) GPIO
+# pairs lit for values[i][n]; index[i] maps a value back to n.
+CompiledLayout = namedtuple('CompiledLayout', ['widgets', 'values', 'segments', 'index', 'max_segments'])
+
+
+def initial_values(layout=LAYOUT):
+    return tuple(widget_values(description)[0] for description in layout.values())
+
+
+def widget_values(description):
+    kind = description['type']
+    if kind == 'digit':
+        return tuple(description['values'])
+    if kind == 'bar':
+        return tuple(description['levels'])
+    return tuple(description['states'])
+
+
+def widget_elements(name, description):
+    """Yield (value, [(element, high pin name, low pin name), ...]) for each value."""
+    kind = description['type']
+    if kind == 'digit':
+        common = description['common']
+        wired = description['segments']
+        for value in description['values']:
+            if value == 0 and description.get('blank_zero'):
+                yield value, []
+                continue
+            lit = [segment for bit, segment in enumerate(SEGMENTS) if GLYPHS[value] >> bit & 1]
+            missing = [segment for segment in lit if segment not in wired]
+            if missing:
+                raise ValueError(f'{name} cannot show {value}: segments {"".join(missing)} are not wired')
+            yield value, [(segment, wired[segment], common) for segment in lit]
+    elif kind == 'bar':
+        common = description['common']
+        pins = description['pins']
+        for level, value in enumerate(description['levels']):
+            # Scan the newest level first, as the bars always have.
+            yield value, [(pin, pin, common) for pin in reversed(pins[:level])]
+    elif kind == 'indicator':
+        for value, pairs in description['states'].items():
+            yield value, [(pair, pair[0], pair[1]) for pair in pairs]
+    else:
+        raise ValueError(f'{name} has unknown widget type {kind!r}')
+
+
+def compile_layout(layout=LAYOUT, pins=PINS):
+    owners = {}
+    values = []
+    segments = []
+    for name, description in layout.items():
+        widget_value_list = []
+        widget_segments = []
+        for value, elements in widget_elements(name, description):
+            pairs = []
+            for element, high, low in elements:
+                if high not in pins or low not in pins:
+                    raise ValueError(f'{name} uses unknown pin {high if high not in pins else low}')
+                if high == low:
+                    raise ValueError(f'{name} drives {high} both high and low')
+                pair = (pins[high], pins[low])
+                owner = owners.setdefault(pair, (name, element))
+                if owner != (name, element):
+                    raise ValueError(f'{high}->{low} is used by both {owner[0]} {owner[1]} and {name} {element}')
+                pairs.append(pair)
+            widget_value_list.append(value)
+            widget_segments.append(tuple(pairs))
+        values.append(tuple(widget_value_list))
+        segments.append(tuple(widget_segments))
+    max_segments = sum(max(len(pairs) for pairs in widget_segments) for widget_segments in segments)
+    return tuple(layout), tuple(values), tuple(segments), max_segments
+
+
+def check_tables(compiled, layout=LAYOUT, pins=PINS):
+    """Raise ValueError unless compiled tables fit the layout and pins.
+
+    Used on tables read back from the cache, which compile_layout's own
+    checks never saw.
+    """
+    widgets, values, segments, max_segments = compiled
+    if widgets != tuple(layout) or len(values) != len(widgets) or len(segments) != len(widgets):
+        raise ValueError('widgets do not match the layout')
+    gpio_pins = set(pins.values())
+    owners = {}
+    for name, description, widget_value_list, widget_segments in zip(widgets, layout.values(), values, segments):
+        if widget_value_list != widget_values(description) or len(widget_segments) != len(widget_value_list):
+            raise ValueError(f'{name} values do not match the layout')
+        for pairs in widget_segments:
+            if len(set(pairs)) != len(pairs):
+                raise ValueError(f'{name} lights the same pin pair twice')
+            for pair in pairs:
+                if len(pair) != 2 or not set(pair) <= gpio_pins or pair[0] == pair[1]:
+                    raise ValueError(f'{name} has invalid pin pair {pair!r}')
+                if owners.setdefault(pair, name) != name:
+                    raise ValueError(f'{pair!r} is used by both {owners[pair]} and {name}')
+    if max_segments != sum(max(len(pairs) for pairs in widget_segments) for widget_segments in segments):
+        raise ValueError('max_segments does not match the tables')
+
+
+def layout_key(layout, pins):
+    return hashlib.sha1(repr((COMPILER_VERSION, pins, GLYPHS, layout)).encode()).hexdigest()
+
+
+def read_cache(cache_path, key, layout, pins):
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached['key'] != key:
+            return None
+        compiled = (
+            tuple(cached['widgets']),
+            tuple(tuple(widget_value_list) for widget_value_list in cached['values']),
+            tuple(tuple(tuple(tuple(pair) for pair in pairs) for pairs in widget_segments)
+                  for widget_segments in cached['segments']),
+            cached['max_segments'],
+        )
+        check_tables(compiled, layout, pins)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError, KeyError) as e:
+        logging.warning("Ignoring layout cache %s: %s", cache_path, e)
+        return None
+    return compiled
+
+
+def load(layout=LAYOUT, pins=PINS, cache_path=LAYOUT_CACHE_PATH):
+    compiled = None
+    if cache_path:
+        key = layout_key(layout, pins)
+        compiled = read_cache(cache_path, key, layout, pins)
+    if compiled is None:
+        compiled = compile_layout(layout, pins)
+        if cache_path:
+            widgets, values, segments, max_segments = compiled
+            try:
+                tmp_path = cache_path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump({'key': key, 'widgets': widgets, 'values': values, 'segments': segments,
+                               'max_segments': max_segments}, f)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                logging.warning("Could not cache compiled layout: %s", e)
+    widgets, values, segments, max_segments = compiled
+    index = tuple({value: position for position, value in enumerate(widget_values)} for widget_values in values)
+    return CompiledLayout(widgets, values, segments, index, max_segments)
@@ -2,99 +2,250 @@
 
 import json
 import logging
-import RPi.GPIO as GPIO
-import smbus
-import struct
+import os
+import signal
 import sys
-from time import sleep
+from collections import namedtuple
+from threading import Event
+from time import monotonic, perf_counter, sleep, time
 
+import gpio_backend
+import sensors
+from battery_channel import VOLTAGE_LEVELS, BatteryPublisher
+from instrumentation import REGISTRY, serve
+from telemetry import LevelFilter, TelemetryHistory
+
+# Compatibility export for readers of the old file; set to None to disable.
 BATTERY_FILE_PATH = 'battery.json'
 CHARGING_STATUS_PORT = 6
+CHARGING_ACTIVE_LEVEL = 1  # Input level while the charger is plugged in
+CHARGING_BOUNCE_MS = 200
 I2C_ADDR = 0x36
+READ_RETRIES = 3
+RETRY_BACKOFF = 0.01  # Seconds, doubled after every failed attempt
+MAX_RETRY_BACKOFF = 0.1
+
+METRICS_PORT = 9105
+
+I2C_SECONDS = REGISTRY.histogram(
+    'battery_i2c_read_seconds', 'Latency of fuel gauge I2C block reads, including failed attempts.',
+    (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1))
+I2C_ERRORS = REGISTRY.counter('battery_i2c_errors_total', 'Failed fuel gauge I2C read attempts.')
+STALE_SAMPLES = REGISTRY.counter('battery_stale_samples_total', 'Polls that fell back to the last good sample.')
+LOOP_ERRORS = REGISTRY.counter('battery_loop_errors_total', 'Battery polling loop iterations that raised.')
+
+# Adaptive polling: fast right after a change, backing off while readings are stable.
+MIN_POLL_INTERVAL = 1
+RETRY_INTERVAL = 1  # Seconds before the next poll after a failed or empty one
+MAX_POLL_INTERVAL = 60
+VOLTAGE_SWING = 0.05  # Volts between consecutive samples that count as a change
+
+# stale is True when the fuel gauge could not be read and this is the last good sample.
+BatterySample = namedtuple('BatterySample', ['voltage', 'capacity', 'timestamp', 'stale'])
 
 class BatteryMonitor:
-    def __init__(self, bus_number=1, address=0x36):
-        self.bus = smbus.SMBus(bus_number)
-        self.address = address
+    def __init__(self, bus_number=1, address=0x36, retries=READ_RETRIES, backoff=RETRY_BACKOFF, source=None):
+        self.source = source if source is not None else sensors.get_source(bus_number, address)
+        self.retries = retries
+        self.backoff = backoff
+        self.last_sample = None
 
-    def readVoltage(self):
-        try:
-            read = self.bus.read_word_data(self.address, 2)
-            swapped = struct.unpack("<H", struct.pack(">H", read))[0]
-            return swapped * 1.25 / 1000 / 16
-        except Exception as e:
-            logging.error("Error reading voltage: %s", e)
-            return None
+    def readSample(self):
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            start = perf_counter()
+            try:
+                vcell, soc = self.source.read('battery')
+                I2C_SECONDS.observe(perf_counter() - start)
+                break
+            except Exception as e:
+                I2C_SECONDS.observe(perf_counter() - start)
+                I2C_ERRORS.inc()
+                error = e
+                if attempt < self.retries:
+                    sleep(delay)
+                    delay = min(delay * 2, MAX_RETRY_BACKOFF)
+        else:
+            logging.error("Error reading fuel gauge: %s", error)
+            if self.last_sample is None:
+                return None
+            STALE_SAMPLES.inc()
+            return self.last_sample._replace(stale=True)
 
-    def readCapacity(self):
-        try:
-            read = self.bus.read_word_data(self.address, 4)
-            swapped = struct.unpack("<H", struct.pack(">H", read))[0]
-            capacity = swapped / 256
-            return round(capacity)  # Round to the nearest whole number
-        except Exception as e:
-            logging.error("Error reading capacity: %s", e)
-            return None
+        voltage = vcell * 1.25 / 1000 / 16
+        capacity = round(soc / 256)  # Round to the nearest whole number
+        self.last_sample = BatterySample(voltage, capacity, monotonic(), False)
+        return self.last_sample
+
+class AdaptivePoller:
+    def __init__(self, min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL, swing=VOLTAGE_SWING):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.swing = swing
+        self.interval = min_interval
+        self.last_voltage = None
+
+    def reset(self):
+        self.interval = self.min_interval
+
+    def update(self, voltage):
+        if self.last_voltage is None or abs(voltage - self.last_voltage) >= self.swing:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        self.last_voltage = voltage
+        return self.interval
 
 # Function to prepare capacity reading for display
-def prepare_readCapacity(battery_monitor):
-    capacity = battery_monitor.readCapacity()
+def prepare_readCapacity(capacity):
     capacity_left_digit = capacity // 100
     capacity_middle_digit = (capacity % 100) // 10
     capacity_right_digit = capacity % 10
     return capacity_left_digit, capacity_middle_digit, capacity_right_digit
 
-# Function to prepare voltage reading for display
-def prepare_readVoltage(battery_monitor):
-    voltage = battery_monitor.readVoltage()
-    if voltage > 3.65:
-        return 'six'
-    elif 3.60 < voltage <= 3.65:
-        return 'five'
-    elif 3.55 < voltage <= 3.60:
-        return 'four'
-    elif 3.50 < voltage <= 3.55:
-        return 'three'
-    elif 3.45 < voltage <= 3.50:
-        return 'two'
-    elif 3.40 < voltage <= 3.45:
-        return 'one'
-    elif voltage <= 3.40:
-        return 'off'
-
-# Function to send status to JSON file
-def send_status(capacity_left_digit, capacity_middle_digit, capacity_right_digit, voltage_bar):
-    data = {
-        'left': capacity_left_digit,
-        'middle': capacity_middle_digit,
-        'right': capacity_right_digit,
-        'volts': voltage_bar
-    }
-    with open(BATTERY_FILE_PATH, 'w') as f:
-        json.dump(data, f)
+# Function to read the charger status input
+def is_charging(gpio):
+    return gpio.input(CHARGING_STATUS_PORT) == CHARGING_ACTIVE_LEVEL
+
+# Function to call callback(channel) on charger plug/unplug edges
+def setup_charging_detect(gpio, callback):
+    gpio.setup(CHARGING_STATUS_PORT, gpio.IN)
+    gpio.add_event_detect(CHARGING_STATUS_PORT, gpio.BOTH, callback=callback, bouncetime=CHARGING_BOUNCE_MS)
+
+# What the display and the status channel show for one battery poll
+class BatteryStatus(namedtuple('BatteryStatus', ['capacity_left_digit', 'capacity_middle_digit', 'capacity_right_digit',
+                                                 'voltage_bar', 'stale', 'charging', 'time_to_empty'])):
+    __slots__ = ()
+
+    def as_dict(self):
+        # Same keys as battery.json and BatteryReader.read().
+        return {
+            'left': self.capacity_left_digit,
+            'middle': self.capacity_middle_digit,
+            'right': self.capacity_right_digit,
+            'volts': self.voltage_bar,
+            'stale': self.stale,
+            'charging': self.charging,
+            'time_to_empty': self.time_to_empty
+        }
+
+class BatteryTracker:
+    """One battery poll: charger check, fuel gauge read, voltage smoothing,
+    history and the next poll interval. monitor.main, the daemon and the
+    pipeline benchmark all poll through this."""
+
+    def __init__(self, battery_monitor, history, gpio=None, level_filter=None, poller=None):
+        self.battery_monitor = battery_monitor
+        self.history = history
+        self.gpio = gpio  # None skips the charger check
+        self.level_filter = level_filter if level_filter is not None else LevelFilter()
+        self.poller = poller if poller is not None else AdaptivePoller()
+        self.charging = None
+        self.interval = RETRY_INTERVAL
+
+    def poll(self):
+        """Return the BatteryStatus to show, or None if there is nothing to show yet.
+
+        Never raises; self.interval is the number of seconds until the next poll.
+        """
+        self.interval = RETRY_INTERVAL
+        try:
+            if self.gpio is not None:
+                self.check_charger()
+            sample = self.battery_monitor.readSample()
+            if sample is None:
+                # No good reading yet; try again shortly.
+                return None
+            status = self.process_sample(sample)
+        except Exception as e:
+            LOOP_ERRORS.inc()
+            logging.error("An error occurred while polling the battery: %s", e)
+            return None
+        self.interval = self.poller.interval
+        return status
+
+    def check_charger(self):
+        charging = is_charging(self.gpio)
+        if charging != self.charging:
+            self.charging = charging
+            self.poller.reset()
+            logging.info("Charger %s.", "connected" if charging else "disconnected")
+
+    def process_sample(self, sample, now=None):
+        if now is None:
+            now = time()
+        capacity_left_digit, capacity_middle_digit, capacity_right_digit = prepare_readCapacity(sample.capacity)
+        if not sample.stale:
+            self.level_filter.update(sample.voltage)
+            self.history.append(now, sample.voltage, sample.capacity)
+            self.poller.update(sample.voltage)
+        return BatteryStatus(capacity_left_digit, capacity_middle_digit, capacity_right_digit,
+                             VOLTAGE_LEVELS[self.level_filter.level], sample.stale, bool(self.charging),
+                             self.history.time_to_empty(now))
+
+# Function to publish status to the shared-memory channel and JSON file
+def send_status(status, publisher=None):
+    if publisher is not None:
+        publisher.publish(*status)
+    if BATTERY_FILE_PATH:
+        # Write then rename so readers never see a half-written file.
+        tmp_path = BATTERY_FILE_PATH + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(status.as_dict(), f)
+        os.replace(tmp_path, BATTERY_FILE_PATH)
 
 ##########
 
-def main():
+def main(gpio=None):
     logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
-    GPIO.setwarnings(False)
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setup(CHARGING_STATUS_PORT, GPIO.IN)
+    if gpio is None:
+        gpio = gpio_backend.get_backend()
+    gpio.setwarnings(False)
+    gpio.setmode(gpio.BCM)
+    serve(METRICS_PORT)
+
+    # Charger plug/unplug edges wake the loop immediately.
+    wake = Event()
+    setup_charging_detect(gpio, lambda channel: wake.set())
 
     battery_monitor = BatteryMonitor()
+    publisher = BatteryPublisher()
+    history = TelemetryHistory()
+    tracker = BatteryTracker(battery_monitor, history, gpio)
+
+    # Stop cleanly on SIGTERM from systemd as well as Ctrl-C, so the
+    # finally block below always runs and flushes what we hold open.
+    stop = Event()
+
+    def request_stop(signum, frame):
+        stop.set()
+        wake.set()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, request_stop)
 
     try:
         while True:
-            try:
-                capacity_left_digit, capacity_middle_digit, capacity_right_digit = prepare_readCapacity(battery_monitor)
-                voltage_bar = prepare_readVoltage(battery_monitor)
-                send_status(capacity_left_digit, capacity_middle_digit, capacity_right_digit, voltage_bar)
-                sleep(5)
-            except Exception as e:
-                logging.error("An error occurred in the main loop: %s", e)
-                sleep(1)
+            wake.clear()
+            # request_stop sets stop before wake, so checking after the clear
+            # never misses a signal.
+            if stop.is_set():
+                break
+            status = tracker.poll()
+            interval = tracker.interval
+            if status is not None:
+                try:
+                    send_status(status, publisher)
+                except Exception as e:
+                    LOOP_ERRORS.inc()
+                    logging.error("An error occurred while publishing status: %s", e)
+                    interval = RETRY_INTERVAL
+            wake.wait(interval)
     finally:
-        GPIO.cleanup()
+        battery_monitor.source.close()
+        publisher.close()
+        history.close()
+        gpio.cleanup()
         logging.info("GPIO cleanup complete.")
 
 if __name__ == '__main__':
@@ -0,0 +1,112 @@
+"""Deadline-driven timing for the display scan loop.
+
+A frame is split into a fixed number of equal slots, one per segment that
+could ever be lit, so a segment's on-time does not depend on how many others
+are lit. Waits sleep until shortly before a perf_counter_ns deadline and spin
+for the rest, since plain sleep() overshoots 100us periods badly.
+"""
+
+import ctypes
+import logging
+import os
+from time import perf_counter_ns, sleep
+
+# A sleep can end up to the thread's timer slack late (50us by default on
+# Linux) plus the wake-up latency, so wait_until spins for that much of the
+# remaining time. The scan thread lowers its slack to SCAN_TIMER_SLACK_NS,
+# which keeps the spin short enough to sleep through most of each slot.
+DEFAULT_TIMER_SLACK_NS = 50_000
+SCAN_TIMER_SLACK_NS = 1
+WAKEUP_MARGIN_NS = 20_000
+# Waits longer than a slot, such as the idle tail of a frame, let the CPU
+# reach deeper idle states that take longer to wake from.
+IDLE_WAKEUP_MARGIN_NS = 100_000
+REALTIME_PRIORITY = 50
+
+PR_SET_TIMERSLACK = 29
+PR_GET_TIMERSLACK = 30
+
+
+class ScanScheduler:
+    def __init__(self, frame_period_ns, slots, spin_ns=None, tolerance_ns=None):
+        self.frame_period_ns = frame_period_ns
+        self.slots = max(1, slots)
+        self.slot_ns = frame_period_ns // self.slots
+        # None derives the spin from the timer slack of the waiting thread.
+        self.fixed_spin_ns = spin_ns
+        self.spin_ns = spin_ns if spin_ns is not None else timer_slack_ns() + WAKEUP_MARGIN_NS
+        # How late a deadline may be hit before it counts as missed.
+        self.tolerance_ns = self.slot_ns if tolerance_ns is None else tolerance_ns
+        self.frame_start = None
+        self.frames = 0
+        self.missed_deadlines = 0
+
+    def bind_thread(self, slack_ns=SCAN_TIMER_SLACK_NS):
+        """Prepare the calling thread to run the scan: lower its timer slack
+        and size the spin to what its sleeps can now overshoot by."""
+        set_timer_slack(slack_ns)
+        if self.fixed_spin_ns is None:
+            self.spin_ns = timer_slack_ns() + WAKEUP_MARGIN_NS
+
+    def wait_until(self, deadline):
+        remaining = deadline - perf_counter_ns()
+        if remaining < -self.tolerance_ns:
+            self.missed_deadlines += 1
+            return
+        spin_ns = self.spin_ns if remaining <= self.slot_ns else self.spin_ns + IDLE_WAKEUP_MARGIN_NS
+        if remaining > spin_ns:
+            sleep((remaining - spin_ns) / 1e9)
+        while perf_counter_ns() < deadline:
+            pass
+
+    def begin_frame(self):
+        if self.frame_start is None:
+            self.frame_start = perf_counter_ns()
+        return self.frame_start
+
+    def end_frame(self):
+        """Wait out the rest of the frame and return its length in nanoseconds."""
+        deadline = self.frame_start + self.frame_period_ns
+        self.wait_until(deadline)
+        now = perf_counter_ns()
+        elapsed = now - self.frame_start
+        self.frames += 1
+        # Stay on the fixed frame grid unless we fell behind it, in which
+        # case start over from now rather than rushing to catch up.
+        self.frame_start = deadline if now - deadline <= self.tolerance_ns else now
+        return elapsed
+
+
+def prctl(option, value=0):
+    return ctypes.CDLL(None, use_errno=True).prctl(option, value, 0, 0, 0)
+
+
+def timer_slack_ns():
+    """Timer slack of the calling thread, or the Linux default if unknown."""
+    try:
+        slack = prctl(PR_GET_TIMERSLACK)
+    except (AttributeError, OSError):
+        return DEFAULT_TIMER_SLACK_NS
+    return slack if slack > 0 else DEFAULT_TIMER_SLACK_NS
+
+
+def set_timer_slack(slack_ns):
+    """Set the calling thread's timer slack, the most its sleeps may be delayed."""
+    try:
+        if prctl(PR_SET_TIMERSLACK, slack_ns) != 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+    except (AttributeError, OSError) as e:
+        logging.warning("Could not set timer slack: %s", e)
+
+
+def enable_realtime(priority=REALTIME_PRIORITY, cpus=None):
+    """Move the calling thread to SCHED_FIFO and optionally pin it to cpus."""
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+    except (AttributeError, OSError) as e:
+        logging.warning("Could not enable real-time scheduling: %s", e)
+    if cpus is not None:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as e:
+            logging.warning("Could not set CPU affinity: %s", e)
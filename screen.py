@@ -1,172 +1,194 @@
-import RPi.GPIO as GPIO
-from threading import Thread, Event
-from time import sleep
-import psutil
-import json
-import os
+import logging
+from collections import namedtuple
+from functools import partial
+from threading import Thread, Event, Lock
+from time import perf_counter, sleep
+
+import gpio_backend
+import layout
+import scan_scheduler
+from battery_channel import BATTERY_NOTIFY_PATH, BatteryReader
+from instrumentation import REGISTRY, serve
+from scan_scheduler import ScanScheduler
+from sysmetrics import SystemSampler
+
+METRICS_PORT = 9106
+
+SCAN_FRAME_SECONDS = REGISTRY.histogram(
+    'display_scan_frame_seconds', 'Wall time of each display scan frame.',
+    (0.001, 0.0025, 0.005, 0.0055, 0.006, 0.0075, 0.01, 0.025, 0.1))
+READ_CYCLE_SECONDS = REGISTRY.histogram(
+    'display_read_cycle_seconds', 'Time spent refreshing system metrics per cycle.',
+    (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05))
+READ_ERRORS = REGISTRY.counter('display_read_errors_total', 'Failed metric or battery reads.')
+# Minimum seconds between read cycles after a failure, so a broken
+# sensor cannot turn the loop into a busy spin.
+READ_ERROR_BACKOFF = 1.0
+
+WIDGETS = tuple(layout.LAYOUT)
+
+# Everything a frame shows. Instances are immutable: producers swap in a new
+# one with a single assignment, so the scan thread never sees a partial update.
+class DisplayState(namedtuple('DisplayState', WIDGETS + ('version',))):
+    __slots__ = ()
+
+INITIAL_STATE = DisplayState(*layout.initial_values(), version=0)
 
 class LEDDisplay:
-    REFRESH_RATE = 0.0001
-    BATTERY_FILE_PATH = 'battery.json'
+    # Full scan frames per second; every segment that can be lit gets an
+    # equal slot of each frame.
+    FRAME_RATE = 200
+    # Run the scan thread under SCHED_FIFO, optionally pinned to these CPUs.
+    SCAN_REALTIME = False
+    SCAN_PRIORITY = scan_scheduler.REALTIME_PRIORITY
+    SCAN_CPUS = None
+    # Seconds between samples of each system metric.
+    METRIC_INTERVALS = {'temperature': 1.0, 'cpu': 0.5, 'ram': 2.0}
+    WIDGETS = WIDGETS
 
-    def __init__(self):
-        self.pins = {
-            'Pin1': 17, 'Pin2': 27, 'Pin3': 22, 'Pin4': 23, 'Pin5': 24, 'Pin6': 25, 'Pin7': 13, 'Pin8': 16,
-        }
+    def __init__(self, gpio=None):
+        self.gpio = gpio if gpio is not None else gpio_backend.get_backend()
+        self.pins = dict(layout.PINS)
         self.setup_gpio()
 
-        self.voltage_bar = ['off']
-        self.capacity_left_digit = [0]
-        self.capacity_middle_digit = [0]
-        self.capacity_right_digit = [0]
-        self.misc_lights = ['off']
-        self.usage_arrow = ['off']
-        self.temp_left_digit = [0]
-        self.temp_middle_digit = [0]
-        self.temp_right_digit = [0]
-        self.ram_bar = ['off']
-        
+        self.state = INITIAL_STATE
+        # Serializes producers only; the scan thread reads self.state without it.
+        self.state_lock = Lock()
+
         self.stop_event = Event()
+        self.scan_version = None
+        self.scan_plan = []
+        # Software PWM duty cycle, 0.0 to 1.0, globally and per widget.
+        self.brightness = 1.0
+        self.widget_brightness = {}
 
-        # Define segment control mappings for a multiplexed display
-        self.segment_mappings = {
-            'voltage_bar': {
-                'off': [],
-                'one': [(self.pins['Pin1'], self.pins['Pin8'])],
-                'two': [(self.pins['Pin2'], self.pins['Pin8']), (self.pins['Pin1'], self.pins['Pin8'])],
-                'three': [(self.pins['Pin3'], self.pins['Pin8']), (self.pins['Pin2'], self.pins['Pin8']), (self.pins['Pin1'], self.pins['Pin8'])],
-                'four': [(self.pins['Pin4'], self.pins['Pin8']), (self.pins['Pin3'], self.pins['Pin8']), (self.pins['Pin2'], self.pins['Pin8']), (self.pins['Pin1'], self.pins['Pin8'])],
-                'five': [(self.pins['Pin7'], self.pins['Pin8']), (self.pins['Pin4'], self.pins['Pin8']), (self.pins['Pin3'], self.pins['Pin8']), (self.pins['Pin2'], self.pins['Pin8']), (self.pins['Pin1'], self.pins['Pin8'])],
-                'six': [(self.pins['Pin5'], self.pins['Pin8']), (self.pins['Pin7'], self.pins['Pin8']), (self.pins['Pin4'], self.pins['Pin8']), (self.pins['Pin3'], self.pins['Pin8']), (self.pins['Pin2'], self.pins['Pin8']), (self.pins['Pin1'], self.pins['Pin8'])]
-            },
-            'capacity_left_digit': {
-                0: [],
-                1: [(self.pins['Pin2'], self.pins['Pin7']), (self.pins['Pin3'], self.pins['Pin7'])]
-            },
-            'capacity_middle_digit': {
-                0: [(self.pins['Pin2'], self.pins['Pin1']), (self.pins['Pin3'], self.pins['Pin1']), (self.pins['Pin4'], self.pins['Pin1']), (self.pins['Pin8'], self.pins['Pin1']), (self.pins['Pin7'], self.pins['Pin1']), (self.pins['Pin5'], self.pins['Pin1'])],
-                1: [(self.pins['Pin3'], self.pins['Pin1']), (self.pins['Pin4'], self.pins['Pin1'])],
-                2: [(self.pins['Pin2'], self.pins['Pin1']), (self.pins['Pin3'], self.pins['Pin1']), (self.pins['Pin8'], self.pins['Pin1']), (self.pins['Pin7'], self.pins['Pin1']), (self.pins['Pin6'], self.pins['Pin1'])],
-                3: [(self.pins['Pin2'], self.pins['Pin1']), (self.pins['Pin3'], self.pins['Pin1']), (self.pins['Pin4'], self.pins['Pin1']), (self.pins['Pin8'], self.pins['Pin1']), (self.pins['Pin6'], self.pins['Pin1'])],
-                4: [(self.pins['Pin3'], self.pins['Pin1']), (self.pins['Pin4'], self.pins['Pin1']), (self.pins['Pin5'], self.pins['Pin1']), (self.pins['Pin6'], self.pins['Pin1'])],
-                5: [(self.pins['Pin2'], self.pins['Pin1']), (self.pins['Pin4'], self.pins['Pin1']), (self.pins['Pin8'], self.pins['Pin1']), (self.pins['Pin7'], self.pins['Pin1']), (self.pins['Pin6'], self.pins['Pin1'])],
-                6: [(self.pins['Pin2'], self.pins['Pin1']), (self.pins['Pin4'], self.pins['Pin1']), (self.pins['Pin8'], self.pins['Pin1']), (self.pins['Pin7'], self.pins['Pin1']), (self.pins['Pin5'], self.pins['Pin1']), (self.pins['Pin6'], self.pins['Pin1'])],
-                7: [(self.pins['Pin2'], self.pins['Pin1']), (self.pins['Pin3'], self.pins['Pin1']), (self.pins['Pin4'], self.pins['Pin1'])],
-                8: [(self.pins['Pin2'], self.pins['Pin1']), (self.pins['Pin3'], self.pins['Pin1']), (self.pins['Pin4'], self.pins['Pin1']), (self.pins['Pin8'], self.pins['Pin1']), (self.pins['Pin7'], self.pins['Pin1']), (self.pins['Pin5'], self.pins['Pin1']), (self.pins['Pin6'], self.pins['Pin1'])],
-                9: [(self.pins['Pin2'], self.pins['Pin1']), (self.pins['Pin3'], self.pins['Pin1']), (self.pins['Pin4'], self.pins['Pin1']), (self.pins['Pin8'], self.pins['Pin1']), (self.pins['Pin5'], self.pins['Pin1']), (self.pins['Pin6'], self.pins['Pin1'])]
-            },
-            'capacity_right_digit': {
-                0: [(self.pins['Pin1'], self.pins['Pin2']), (self.pins['Pin3'], self.pins['Pin2']), (self.pins['Pin4'], self.pins['Pin2']), (self.pins['Pin8'], self.pins['Pin2']), (self.pins['Pin7'], self.pins['Pin1']), (self.pins['Pin5'], self.pins['Pin4'])],
-                1: [(self.pins['Pin3'], self.pins['Pin2']), (self.pins['Pin4'], self.pins['Pin2'])],
-                2: [(self.pins['Pin1'], self.pins['Pin2']), (self.pins['Pin3'], self.pins['Pin2']), (self.pins['Pin8'], self.pins['Pin2']), (self.pins['Pin7'], self.pins['Pin2']), (self.pins['Pin6'], self.pins['Pin2'])],
-                3: [(self.pins['Pin1'], self.pins['Pin2']), (self.pins['Pin3'], self.pins['Pin2']), (self.pins['Pin4'], self.pins['Pin2']), (self.pins['Pin8'], self.pins['Pin2']), (self.pins['Pin6'], self.pins['Pin2'])],
-                4: [(self.pins['Pin3'], self.pins['Pin2']), (self.pins['Pin4'], self.pins['Pin2']), (self.pins['Pin5'], self.pins['Pin2']), (self.pins['Pin6'], self.pins['Pin2'])],
-                5: [(self.pins['Pin1'], self.pins['Pin2']), (self.pins['Pin4'], self.pins['Pin2']), (self.pins['Pin8'], self.pins['Pin2']), (self.pins['Pin5'], self.pins['Pin2']), (self.pins['Pin6'], self.pins['Pin2'])],
-                6: [(self.pins['Pin1'], self.pins['Pin2']), (self.pins['Pin4'], self.pins['Pin2']), (self.pins['Pin8'], self.pins['Pin2']), (self.pins['Pin7'], self.pins['Pin2']), (self.pins['Pin5'], self.pins['Pin2']), (self.pins['Pin6'], self.pins['Pin2'])],
-                7: [(self.pins['Pin1'], self.pins['Pin2']), (self.pins['Pin3'], self.pins['Pin2']), (self.pins['Pin4'], self.pins['Pin2'])],
-                8: [(self.pins['Pin1'], self.pins['Pin2']), (self.pins['Pin3'], self.pins['Pin2']), (self.pins['Pin4'], self.pins['Pin2']), (self.pins['Pin8'], self.pins['Pin2']), (self.pins['Pin7'], self.pins['Pin2']), (self.pins['Pin5'], self.pins['Pin2']), (self.pins['Pin6'], self.pins['Pin2'])],
-                9: [(self.pins['Pin1'], self.pins['Pin2']), (self.pins['Pin3'], self.pins['Pin2']), (self.pins['Pin4'], self.pins['Pin2']), (self.pins['Pin8'], self.pins['Pin2']), (self.pins['Pin5'], self.pins['Pin2']), (self.pins['Pin6'], self.pins['Pin2'])]
-            },
-            'misc_lights': {
-                'on': [(self.pins['Pin6'], self.pins['Pin8']), (self.pins['Pin1'], self.pins['Pin7']), (self.pins['Pin1'], self.pins['Pin5']), (self.pins['Pin8'], self.pins['Pin5']), (self.pins['Pin2'], self.pins['Pin5']), (self.pins['Pin7'], self.pins['Pin5']), (self.pins['Pin5'], self.pins['Pin6'])],
-                'off': []
-            },
-            'usage_arrow': {
-                'turbo': [(self.pins['Pin3'], self.pins['Pin5'])],
-                'norm': [(self.pins['Pin4'], self.pins['Pin5'])],
-                'off': []
-            },
-            'temp_left_digit': {
-                0: [],
-                1: [(self.pins['Pin5'], self.pins['Pin7']), (self.pins['Pin8'], self.pins['Pin7'])]
-            },
-            'temp_middle_digit': {
-                0: [(self.pins['Pin1'], self.pins['Pin3']), (self.pins['Pin2'], self.pins['Pin3']), (self.pins['Pin4'], self.pins['Pin3']), (self.pins['Pin8'], self.pins['Pin3']), (self.pins['Pin7'], self.pins['Pin3']), (self.pins['Pin5'], self.pins['Pin3'])],
-                1: [(self.pins['Pin2'], self.pins['Pin3']), (self.pins['Pin4'], self.pins['Pin3'])],
-                2: [(self.pins['Pin1'], self.pins['Pin3']), (self.pins['Pin2'], self.pins['Pin3']), (self.pins['Pin8'], self.pins['Pin3']), (self.pins['Pin7'], self.pins['Pin3']), (self.pins['Pin6'], self.pins['Pin3'])],
-                3: [(self.pins['Pin1'], self.pins['Pin3']), (self.pins['Pin2'], self.pins['Pin3']), (self.pins['Pin4'], self.pins['Pin3']), (self.pins['Pin8'], self.pins['Pin3']), (self.pins['Pin6'], self.pins['Pin3'])],
-                4: [(self.pins['Pin2'], self.pins['Pin3']), (self.pins['Pin4'], self.pins['Pin3']), (self.pins['Pin5'], self.pins['Pin3']), (self.pins['Pin6'], self.pins['Pin3'])],
-                5: [(self.pins['Pin1'], self.pins['Pin3']), (self.pins['Pin4'], self.pins['Pin3']), (self.pins['Pin8'], self.pins['Pin3']), (self.pins['Pin7'], self.pins['Pin3']), (self.pins['Pin6'], self.pins['Pin3'])],
-                6: [(self.pins['Pin1'], self.pins['Pin3']), (self.pins['Pin4'], self.pins['Pin3']), (self.pins['Pin8'], self.pins['Pin3']), (self.pins['Pin7'], self.pins['Pin3']), (self.pins['Pin5'], self.pins['Pin3']), (self.pins['Pin6'], self.pins['Pin3'])],
-                7: [(self.pins['Pin1'], self.pins['Pin3']), (self.pins['Pin2'], self.pins['Pin3']), (self.pins['Pin4'], self.pins['Pin3'])],
-                8: [(self.pins['Pin1'], self.pins['Pin3']), (self.pins['Pin2'], self.pins['Pin3']), (self.pins['Pin4'], self.pins['Pin3']), (self.pins['Pin8'], self.pins['Pin3']), (self.pins['Pin7'], self.pins['Pin3']), (self.pins['Pin5'], self.pins['Pin3']), (self.pins['Pin6'], self.pins['Pin3'])],
-                9: [(self.pins['Pin1'], self.pins['Pin3']), (self.pins['Pin2'], self.pins['Pin3']), (self.pins['Pin4'], self.pins['Pin3']), (self.pins['Pin8'], self.pins['Pin3']), (self.pins['Pin5'], self.pins['Pin3']), (self.pins['Pin6'], self.pins['Pin3'])]
-            },
-            'temp_right_digit': {
-                0: [(self.pins['Pin1'], self.pins['Pin4']), (self.pins['Pin2'], self.pins['Pin4']), (self.pins['Pin3'], self.pins['Pin4']), (self.pins['Pin8'], self.pins['Pin4']), (self.pins['Pin7'], self.pins['Pin4']), (self.pins['Pin5'], self.pins['Pin4'])],
-                1: [(self.pins['Pin2'], self.pins['Pin4']), (self.pins['Pin3'], self.pins['Pin4'])],
-                2: [(self.pins['Pin1'], self.pins['Pin4']), (self.pins['Pin2'], self.pins['Pin4']), (self.pins['Pin8'], self.pins['Pin4']), (self.pins['Pin7'], self.pins['Pin4']), (self.pins['Pin6'], self.pins['Pin4'])],
-                3: [(self.pins['Pin1'], self.pins['Pin4']), (self.pins['Pin2'], self.pins['Pin4']), (self.pins['Pin3'], self.pins['Pin4']), (self.pins['Pin8'], self.pins['Pin4']), (self.pins['Pin6'], self.pins['Pin4'])],
-                4: [(self.pins['Pin2'], self.pins['Pin4']), (self.pins['Pin3'], self.pins['Pin4']), (self.pins['Pin5'], self.pins['Pin4']), (self.pins['Pin6'], self.pins['Pin4'])],
-                5: [(self.pins['Pin1'], self.pins['Pin4']), (self.pins['Pin3'], self.pins['Pin4']), (self.pins['Pin8'], self.pins['Pin4']), (self.pins['Pin5'], self.pins['Pin4']), (self.pins['Pin6'], self.pins['Pin4'])],
-                6: [(self.pins['Pin1'], self.pins['Pin4']), (self.pins['Pin3'], self.pins['Pin4']), (self.pins['Pin8'], self.pins['Pin4']), (self.pins['Pin7'], self.pins['Pin4']), (self.pins['Pin5'], self.pins['Pin4']), (self.pins['Pin6'], self.pins['Pin4'])],
-                7: [(self.pins['Pin1'], self.pins['Pin4']), (self.pins['Pin2'], self.pins['Pin4']), (self.pins['Pin3'], self.pins['Pin4'])],
-                8: [(self.pins['Pin1'], self.pins['Pin4']), (self.pins['Pin2'], self.pins['Pin4']), (self.pins['Pin3'], self.pins['Pin4']), (self.pins['Pin8'], self.pins['Pin4']), (self.pins['Pin7'], self.pins['Pin4']), (self.pins['Pin5'], self.pins['Pin4']), (self.pins['Pin6'], self.pins['Pin4'])],
-                9: [(self.pins['Pin1'], self.pins['Pin4']), (self.pins['Pin2'], self.pins['Pin4']), (self.pins['Pin3'], self.pins['Pin4']), (self.pins['Pin8'], self.pins['Pin4']), (self.pins['Pin5'], self.pins['Pin4']), (self.pins['Pin6'], self.pins['Pin4'])]
-            },
-            'ram_bar': {
-                'off': [],
-                'one': [(self.pins['Pin1'], self.pins['Pin6'])],
-                'two': [(self.pins['Pin2'], self.pins['Pin6']), (self.pins['Pin1'], self.pins['Pin6'])],
-                'three': [(self.pins['Pin3'], self.pins['Pin6']), (self.pins['Pin2'], self.pins['Pin6']), (self.pins['Pin1'], self.pins['Pin6'])],
-                'four': [(self.pins['Pin4'], self.pins['Pin6']), (self.pins['Pin3'], self.pins['Pin6']), (self.pins['Pin2'], self.pins['Pin6']), (self.pins['Pin1'], self.pins['Pin6'])],
-                'five': [(self.pins['Pin8'], self.pins['Pin6']), (self.pins['Pin4'], self.pins['Pin6']), (self.pins['Pin3'], self.pins['Pin6']), (self.pins['Pin2'], self.pins['Pin6']), (self.pins['Pin1'], self.pins['Pin6'])],
-                'six': [(self.pins['Pin7'], self.pins['Pin6']), (self.pins['Pin8'], self.pins['Pin6']), (self.pins['Pin4'], self.pins['Pin6']), (self.pins['Pin3'], self.pins['Pin6']), (self.pins['Pin2'], self.pins['Pin6']), (self.pins['Pin1'], self.pins['Pin6'])]
-            }
-        }
+        # Per-widget tables of (high, low) pin pairs, compiled from layout.LAYOUT.
+        self.layout = layout.load(pins=self.pins)
+        self.scheduler = ScanScheduler(10**9 // self.FRAME_RATE, self.layout.max_segments)
+        REGISTRY.callback('display_scan_frames_total', 'Display scan frames rendered.',
+                          lambda: self.scheduler.frames, 'counter')
+        REGISTRY.callback('display_scan_missed_deadlines_total', 'Scan slot deadlines missed by more than a slot.',
+                          lambda: self.scheduler.missed_deadlines, 'counter')
+        REGISTRY.callback('display_state_version', 'Version of the displayed state.', lambda: self.state.version)
 
     def setup_gpio(self):
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setwarnings(False)
         for pin in self.pins.values():
-            GPIO.setup(pin, GPIO.IN)
+            self.gpio.setup(pin, self.gpio.IN)
 
     def set_segment(self, pin_high, pin_low):
         for pin in self.pins.values():
-            GPIO.setup(pin, GPIO.IN)
-        GPIO.setup(pin_high, GPIO.OUT)
-        GPIO.setup(pin_low, GPIO.OUT)
-        GPIO.output(pin_high, GPIO.HIGH)
-        GPIO.output(pin_low, GPIO.LOW)
+            self.gpio.setup(pin, self.gpio.IN)
+        self.gpio.setup(pin_high, self.gpio.OUT)
+        self.gpio.setup(pin_low, self.gpio.OUT)
+        self.gpio.output(pin_high, self.gpio.HIGH)
+        self.gpio.output(pin_low, self.gpio.LOW)
 
     def clear_segments(self):
         for pin in self.pins.values():
-            GPIO.setup(pin, GPIO.IN)
+            self.gpio.setup(pin, self.gpio.IN)
+
+    def set_brightness(self, level, widget=None):
+        with self.state_lock:
+            if widget is None:
+                self.brightness = level
+            else:
+                self.widget_brightness[widget] = level
+            # Bump the version so the scan thread recompiles its plan.
+            self.state = self.state._replace(version=self.state.version + 1)
+
+    def update_state(self, **changes):
+        with self.state_lock:
+            state = self.state
+            if all(getattr(state, widget) == value for widget, value in changes.items()):
+                return state
+            self.state = state._replace(version=state.version + 1, **changes)
+            return self.state
+
+    def current_segments(self, state):
+        segments = []
+        for widget, index, pairs, value in zip(self.WIDGETS, self.layout.index, self.layout.segments, state):
+            duty = self.brightness * self.widget_brightness.get(widget, 1.0)
+            if duty > 0:
+                segments.extend((pin_high, pin_low, duty) for pin_high, pin_low in pairs[index[value]])
+        return segments
+
+    def is_full_frame(self, segments):
+        # With every slot lit at full duty the pins never go idle, so the
+        # plan can run back to back with no blanking between frames.
+        return len(segments) == self.scheduler.slots and all(duty >= 1 for _, _, duty in segments)
+
+    def build_scan_plan(self, segments):
+        # Compile the lit segments into one (ops, release, on_ns) step per
+        # segment. ops only holds the GPIO calls for pins whose state differs
+        # from the previous step; release blanks the segment after on_ns for
+        # PWM dimming or before the idle tail of the frame.
+        slot_ns = self.scheduler.slot_ns
+        full = self.is_full_frame(segments)
+        previous = {}
+        if full:
+            previous = {segments[-1][0]: self.gpio.HIGH, segments[-1][1]: self.gpio.LOW}
+        plan = []
+        for index, (pin_high, pin_low, duty) in enumerate(segments):
+            wanted = {pin_high: self.gpio.HIGH, pin_low: self.gpio.LOW}
+            ops = []
+            # Release stale pins first so no unrelated pair is briefly driven.
+            for pin in previous:
+                if pin not in wanted:
+                    ops.append(partial(self.gpio.setup, pin, self.gpio.IN))
+            for pin, level in wanted.items():
+                if pin not in previous:
+                    ops.append(partial(self.gpio.setup, pin, self.gpio.OUT, initial=level))
+                elif previous[pin] != level:
+                    ops.append(partial(self.gpio.output, pin, level))
+            on_ns = min(slot_ns, int(slot_ns * duty))
+            release = ()
+            previous = wanted
+            if on_ns < slot_ns or (not full and index == len(segments) - 1):
+                release = (partial(self.gpio.setup, pin_high, self.gpio.IN),
+                           partial(self.gpio.setup, pin_low, self.gpio.IN))
+                previous = {}
+            plan.append((tuple(ops), release, on_ns))
+        return plan
 
-    def display_segment(self, segments):
-        for pin_high, pin_low in segments:
-            self.set_segment(pin_high, pin_low)
-            sleep(self.REFRESH_RATE)
+    def refresh_scan_plan(self):
+        state = self.state
+        if state.version != self.scan_version:
+            self.scan_version = state.version
+            segments = self.current_segments(state)
+            self.scan_plan = self.build_scan_plan(segments)
+            # Leave the pins as the plan expects to find them at its start.
+            if self.is_full_frame(segments):
+                self.set_segment(*segments[-1][:2])
+            else:
+                self.clear_segments()
+
+    def render_frame(self):
+        self.refresh_scan_plan()
+        scheduler = self.scheduler
+        wait_until = scheduler.wait_until
+        slot_ns = scheduler.slot_ns
+        slot_start = scheduler.begin_frame()
+        for ops, release, on_ns in self.scan_plan:
+            wait_until(slot_start)
+            for op in ops:
+                op()
+            if release:
+                wait_until(slot_start + on_ns)
+                for op in release:
+                    op()
+            slot_start += slot_ns
+        SCAN_FRAME_SECONDS.observe(scheduler.end_frame() / 1e9)
 
     def update_display(self):
+        self.scheduler.bind_thread()
+        if self.SCAN_REALTIME:
+            scan_scheduler.enable_realtime(self.SCAN_PRIORITY, self.SCAN_CPUS)
         while not self.stop_event.is_set():
-            self.clear_segments()
-            self.display_segment(self.segment_mappings['voltage_bar'][self.voltage_bar[0]])
-            self.display_segment(self.segment_mappings['capacity_left_digit'][self.capacity_left_digit[0]])
-            self.display_segment(self.segment_mappings['capacity_middle_digit'][self.capacity_middle_digit[0]])
-            self.display_segment(self.segment_mappings['capacity_right_digit'][self.capacity_right_digit[0]])
-            self.display_segment(self.segment_mappings['misc_lights'][self.misc_lights[0]])
-            self.display_segment(self.segment_mappings['usage_arrow'][self.usage_arrow[0]])
-            self.display_segment(self.segment_mappings['temp_left_digit'][self.temp_left_digit[0]])
-            self.display_segment(self.segment_mappings['temp_middle_digit'][self.temp_middle_digit[0]])
-            self.display_segment(self.segment_mappings['temp_right_digit'][self.temp_right_digit[0]])
-            self.display_segment(self.segment_mappings['ram_bar'][self.ram_bar[0]])
-            sleep(self.REFRESH_RATE)
-
-    def get_ram_usage(self):
-        # Run the 'free' command and capture its output
-        output = os.popen('free -m').readlines()
-        
-        # Extract the memory line, split it into components
-        mem_components = output[1].split()
-
-        # Get total and used memory in megabytes
-        total_mem = int(mem_components[1])
-        used_mem = int(mem_components[2])
-
-        # Calculate the percentage of used memory
-        percentage_used = (used_mem / total_mem) * 100
+            self.render_frame()
 
+    def get_ram_usage(self, percentage_used):
         # Determine the RAM indicator based on the percentage used
         if percentage_used >= 80:
             return 'six'
@@ -181,38 +203,79 @@ class LEDDisplay:
         else:
             return 'one'
 
-    def read_data(self):
-        while not self.stop_event.is_set():
-            try:
-                self.misc_lights[0] = 'on'
-                with open("/sys/class/thermal/thermal_zone0/temp", "r") as file:
-                    temp = int(file.read()) / 1000  # Convert to Celsius
-                # Assuming you want to display the temperature in three digits
-                self.temp_left_digit[0] = int(temp) // 100 # Hundreds place
-                self.temp_middle_digit[0] = int(temp) // 10  # Tens place
-                self.temp_right_digit[0] = int(temp) % 10  # Ones place
-
-                cpu_usage = psutil.cpu_percent(interval=1)  # Get CPU usage percentage
-                # Display CPU usage on LED segments
-                # Determine percent symbol status based on CPU usage
-                if cpu_usage == 100:
-                    self.usage_arrow[0] = 'turbo'  # Set to on when CPU usage is 100%
-                else:
-                    self.usage_arrow[0] = 'norm'
+    def apply_metrics(self, sampler, updated):
+        changes = {'misc_lights': 'on'}
 
-                with open(self.BATTERY_FILE_PATH, 'r') as file:
-                    data = json.load(file)
-                self.capacity_left_digit[0] = data.get('left', 0)
-                self.capacity_middle_digit[0] = data.get('middle', 0)
-                self.capacity_right_digit[0] = data.get('right', 0)
-                self.voltage_bar[0] = data.get('volts', 'off')
+        if 'temperature' in updated:
+            temp = int(sampler.temperature)
+            changes['temp_left_digit'] = temp // 100  # Hundreds place
+            changes['temp_middle_digit'] = temp // 10 % 10  # Tens place
+            changes['temp_right_digit'] = temp % 10  # Ones place
 
-                # Call the get_ram_usage function to update RAM indicator
-                self.ram_bar[0] = self.get_ram_usage()
+        # Determine percent symbol status based on CPU usage
+        if 'cpu' in updated and sampler.cpu_percent is not None:
+            changes['usage_arrow'] = 'turbo' if sampler.cpu_percent >= 100 else 'norm'
 
-            except Exception as e:
-                print(f"Error: {e}")
-            sleep(1)
+        if 'ram' in updated:
+            changes['ram_bar'] = self.get_ram_usage(sampler.ram_percent)
+
+        self.update_state(**changes)
+
+    def refresh_metrics(self, sampler):
+        """Sample the metrics that are due and show them. Returns seconds until
+        the next refresh, backing off after a failed read."""
+        start = perf_counter()
+        failed = False
+        try:
+            self.apply_metrics(sampler, sampler.poll())
+        except Exception as e:
+            failed = True
+            READ_ERRORS.inc()
+            logging.error("An error occurred while collecting metrics: %s", e)
+        for name, error in sampler.errors.items():
+            failed = True
+            READ_ERRORS.inc()
+            logging.error("Could not read %s: %s", name, error)
+        READ_CYCLE_SECONDS.observe(perf_counter() - start)
+        delay = sampler.time_until_next()
+        return max(delay, READ_ERROR_BACKOFF) if failed else delay
+
+    def apply_battery(self, data):
+        self.update_state(
+            capacity_left_digit=data['left'],
+            capacity_middle_digit=data['middle'],
+            capacity_right_digit=data['right'],
+            voltage_bar=data['volts'],
+        )
+
+    def read_data(self):
+        sampler = SystemSampler(self.METRIC_INTERVALS)
+        battery = None
+        try:
+            while not self.stop_event.is_set():
+                timeout = self.refresh_metrics(sampler)
+                try:
+                    # Created here so a failure to bind the notify socket is
+                    # reported and retried like any other read error.
+                    if battery is None:
+                        battery = BatteryReader(notify_path=BATTERY_NOTIFY_PATH)
+                    data = battery.read()
+                    if data is not None:
+                        self.apply_battery(data)
+                except Exception as e:
+                    READ_ERRORS.inc()
+                    logging.error("An error occurred while reading battery status: %s", e)
+                    timeout = max(timeout, READ_ERROR_BACKOFF)
+                # Sleep until the next metric is due, waking early when the
+                # monitor publishes new battery data.
+                if battery is None:
+                    self.stop_event.wait(timeout)
+                else:
+                    battery.wait(timeout)
+        finally:
+            sampler.close()
+            if battery is not None:
+                battery.close()
 
     def start(self):
         Thread(target=self.read_data, daemon=True).start()
@@ -221,10 +284,11 @@ class LEDDisplay:
     def stop(self):
         self.stop_event.set()
         self.clear_segments()
-        GPIO.cleanup()
+        self.gpio.cleanup()
 
 if __name__ == '__main__':
     display = LEDDisplay()
+    serve(METRICS_PORT)
     try:
         display.start()
         while True:
@@ -0,0 +1,200 @@
+"""Pluggable sensor sources with binary trace record and replay.
+
+A source answers read(channel) with a small tuple of raw integer readings:
+
+    battery      (VCELL register, SOC register) from the fuel gauge
+    temperature  (millidegrees C,)
+    cpu          (idle jiffies, total jiffies) from /proc/stat
+    ram          (MemTotal kB, MemAvailable kB) from /proc/meminfo
+
+HardwareSource reads the real devices. RecordingSource wraps another source
+and appends every reading, or failed read, to a trace file as a fixed-size
+record. ReplaySource plays a trace back at real or accelerated speed.
+SENSOR_TRACE=path records and SENSOR_REPLAY=path replays, with
+SENSOR_REPLAY_SPEED as the speed-up, the same way GPIO_BACKEND picks a GPIO
+backend.
+"""
+
+import os
+import struct
+from bisect import bisect_right
+from threading import Lock
+from time import monotonic, time
+
+THERMAL_PATH = '/sys/class/thermal/thermal_zone0/temp'
+STAT_PATH = '/proc/stat'
+MEMINFO_PATH = '/proc/meminfo'
+READ_SIZE = 4096
+
+I2C_ADDR = 0x36
+# VCELL (0x02-0x03) and SOC (0x04-0x05) are contiguous, so one block read covers both.
+VCELL_REGISTER = 0x02
+BLOCK_LENGTH = 4
+
+CHANNELS = ('battery', 'temperature', 'cpu', 'ram')
+ARITY = {'battery': 2, 'temperature': 1, 'cpu': 2, 'ram': 2}
+TRACE_RECORD = struct.Struct('<dBqq')  # Unix timestamp, channel index, up to two readings
+ERROR_FLAG = 0x80
+
+
+class HardwareSource:
+    def __init__(self, bus_number=1, address=I2C_ADDR):
+        self.bus_number = bus_number
+        self.address = address
+        # Devices are opened on first use so a process only touches what it reads.
+        self.bus = None
+        self.fds = {}
+        self.readers = {
+            'battery': self.read_battery,
+            'temperature': self.read_temperature,
+            'cpu': self.read_cpu,
+            'ram': self.read_ram,
+        }
+
+    def read(self, channel):
+        return self.readers[channel]()
+
+    def pread(self, path):
+        fd = self.fds.get(path)
+        if fd is None:
+            fd = self.fds[path] = os.open(path, os.O_RDONLY)
+        return os.pread(fd, READ_SIZE, 0)
+
+    def read_battery(self):
+        if self.bus is None:
+            import smbus
+            self.bus = smbus.SMBus(self.bus_number)
+        vcell_msb, vcell_lsb, soc_msb, soc_lsb = self.bus.read_i2c_block_data(
+            self.address, VCELL_REGISTER, BLOCK_LENGTH)
+        return (vcell_msb << 8) | vcell_lsb, (soc_msb << 8) | soc_lsb
+
+    def read_temperature(self):
+        return (int(self.pread(THERMAL_PATH)),)
+
+    def read_cpu(self):
+        # cpu  user nice system idle iowait irq softirq steal ...
+        fields = [int(value) for value in self.pread(STAT_PATH).split(b'\n', 1)[0].split()[1:9]]
+        return fields[3] + fields[4], sum(fields)
+
+    def read_ram(self):
+        info = {}
+        for line in self.pread(MEMINFO_PATH).splitlines():
+            key, _, value = line.partition(b':')
+            if key in (b'MemTotal', b'MemAvailable'):
+                info[key] = int(value.split()[0])
+                if len(info) == 2:
+                    break
+        return info[b'MemTotal'], info[b'MemAvailable']
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+        if self.bus is not None:
+            self.bus.close()
+            self.bus = None
+
+
+class TraceWriter:
+    def __init__(self, path):
+        # Unbuffered, so every record is on disk as soon as it is read and
+        # nothing is lost if the process is killed.
+        self.file = open(path, 'ab', buffering=0)
+        # The battery and metrics readers may record from different threads.
+        self.lock = Lock()
+
+    def write(self, timestamp, channel, values=(), error=False):
+        index = CHANNELS.index(channel) | (ERROR_FLAG if error else 0)
+        padded = tuple(values) + (0,) * (2 - len(values))
+        record = TRACE_RECORD.pack(timestamp, index, *padded)
+        with self.lock:
+            self.file.write(record)
+
+    def close(self):
+        self.file.close()
+
+
+def read_trace(path):
+    """Return the (timestamp, channel, values, error) records of a trace file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    data = data[:len(data) - len(data) % TRACE_RECORD.size]
+    records = []
+    for timestamp, index, first, second in TRACE_RECORD.iter_unpack(data):
+        channel = CHANNELS[index & ~ERROR_FLAG]
+        records.append((timestamp, channel, (first, second)[:ARITY[channel]], bool(index & ERROR_FLAG)))
+    return records
+
+
+class RecordingSource:
+    def __init__(self, source, path):
+        self.source = source
+        self.writer = TraceWriter(path)
+
+    def read(self, channel):
+        try:
+            values = self.source.read(channel)
+        except Exception:
+            self.writer.write(time(), channel, error=True)
+            raise
+        self.writer.write(time(), channel, values)
+        return values
+
+    def close(self):
+        self.writer.close()
+        self.source.close()
+
+
+class ReplaySource:
+    """Serves the latest trace reading at or before the replay clock.
+
+    The replay clock starts at the first record when the source is created
+    and runs speed times faster than the wall clock.
+    """
+
+    def __init__(self, path, speed=1.0, clock=monotonic):
+        self.speed = speed
+        self.clock = clock
+        self.records = sorted(read_trace(path), key=lambda record: record[0])
+        self.timestamps = {channel: [] for channel in CHANNELS}
+        self.readings = {channel: [] for channel in CHANNELS}
+        for timestamp, channel, values, error in self.records:
+            self.timestamps[channel].append(timestamp)
+            self.readings[channel].append(None if error else values)
+        self.trace_start = self.records[0][0] if self.records else 0.0
+        self.trace_end = self.records[-1][0] if self.records else 0.0
+        self.started = clock()
+
+    def now(self):
+        return self.trace_start + (self.clock() - self.started) * self.speed
+
+    def visible_at(self, timestamp):
+        """Clock time at which a trace timestamp becomes visible to readers."""
+        return self.started + (timestamp - self.trace_start) / self.speed
+
+    def finished(self):
+        return self.now() > self.trace_end
+
+    def read(self, channel):
+        readings = self.readings[channel]
+        if not readings:
+            raise OSError(f'No {channel} readings in trace')
+        index = max(0, bisect_right(self.timestamps[channel], self.now()) - 1)
+        values = readings[index]
+        if values is None:
+            raise OSError(f'Replayed {channel} read error')
+        return values
+
+    def close(self):
+        pass
+
+
+def get_source(bus_number=1, address=I2C_ADDR):
+    replay_path = os.environ.get('SENSOR_REPLAY')
+    if replay_path:
+        return ReplaySource(replay_path, float(os.environ.get('SENSOR_REPLAY_SPEED', '1')))
+    source = HardwareSource(bus_number, address)
+    trace_path = os.environ.get('SENSOR_TRACE')
+    if trace_path:
+        return RecordingSource(source, trace_path)
+    return source
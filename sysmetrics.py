@@ -0,0 +1,93 @@
+"""Non-blocking system metrics for the display.
+
+Readings come from a sensors source, which by default keeps the sysfs/procfs
+files open and re-reads them with pread, so a sample costs one syscall and
+never spawns a process. CPU usage is computed from the /proc/stat counter
+deltas between two samples instead of blocking for an interval, and every
+metric is refreshed on its own schedule.
+"""
+
+from time import monotonic
+
+import sensors
+
+# Seconds between samples of each metric.
+DEFAULT_INTERVALS = {
+    'temperature': 1.0,
+    'cpu': 0.5,
+    'ram': 2.0,
+}
+
+
+class SystemSampler:
+    def __init__(self, intervals=None, source=None):
+        self.intervals = dict(DEFAULT_INTERVALS, **(intervals or {}))
+        # Only close the source if we created it; a shared one belongs to the caller.
+        self.owns_source = source is None
+        self.source = source if source is not None else sensors.get_source()
+        self.samplers = {
+            'temperature': self.sample_temperature,
+            'cpu': self.sample_cpu,
+            'ram': self.sample_ram,
+        }
+        self.temperature = None
+        self.cpu_percent = None
+        self.ram_percent = None
+        self.cpu_idle = None
+        self.cpu_total = None
+        # Metric name -> exception for reads that failed in the last poll.
+        self.errors = {}
+        now = monotonic()
+        self.next_due = dict.fromkeys(self.intervals, now)
+        # Prime the CPU counters so the first scheduled sample has a delta.
+        try:
+            self.sample_cpu()
+        except Exception as e:
+            self.errors['cpu'] = e
+        self.next_due['cpu'] = now + self.intervals['cpu']
+
+    def sample_temperature(self):
+        self.temperature = self.source.read('temperature')[0] / 1000  # Convert to Celsius
+
+    def sample_cpu(self):
+        idle, total = self.source.read('cpu')
+        if self.cpu_total is not None and total > self.cpu_total:
+            busy = (total - self.cpu_total) - (idle - self.cpu_idle)
+            self.cpu_percent = 100.0 * busy / (total - self.cpu_total)
+        self.cpu_idle = idle
+        self.cpu_total = total
+
+    def sample_ram(self):
+        total, available = self.source.read('ram')
+        self.ram_percent = (total - available) / total * 100
+
+    def poll(self, now=None):
+        """Refresh every metric that is due and return the names refreshed.
+
+        A metric whose read fails is left out of the result, its exception is
+        kept in self.errors until the next poll, and it is retried on its
+        normal schedule, so one bad sensor never holds up the others.
+        """
+        if now is None:
+            now = monotonic()
+        updated = []
+        self.errors = {}
+        for name, due in self.next_due.items():
+            if now >= due:
+                self.next_due[name] = now + self.intervals[name]
+                try:
+                    self.samplers[name]()
+                except Exception as e:
+                    self.errors[name] = e
+                else:
+                    updated.append(name)
+        return updated
+
+    def time_until_next(self, now=None):
+        if now is None:
+            now = monotonic()
+        return max(0.0, min(self.next_due.values()) - now)
+
+    def close(self):
+        if self.owns_source:
+            self.source.close()
@@ -0,0 +1,157 @@
+"""On-device battery history, voltage smoothing and time-to-empty.
+
+TelemetryHistory is a fixed-size ring of (timestamp, voltage, capacity)
+records in a memory-mapped file. Appending writes one record and the header,
+never the whole history, and the file is reused after a restart. The size is
+fixed up front, so memory use stays bounded however long the unit runs.
+"""
+
+import mmap
+import os
+import struct
+
+from battery_channel import VOLTAGE_LEVELS
+
+HISTORY_PATH = 'battery_history.bin'
+# 131072 records at one per 30s is about 45 days of history in 2 MiB.
+HISTORY_CAPACITY = 131072
+HISTORY_MIN_SPACING = 30  # Seconds between stored samples
+DISCHARGE_WINDOW = 1800  # Seconds of history used for the discharge rate
+MIN_DISCHARGE_SPAN = 300  # Seconds the window must cover before estimating
+
+HEADER = struct.Struct('<4sIII')  # magic, capacity, next index, count
+RECORD = struct.Struct('<dff')  # Unix timestamp, volts, percent
+MAGIC = b'BTH1'
+
+# Bar level n is lit while the voltage is above VOLTAGE_THRESHOLDS[n - 1].
+VOLTAGE_THRESHOLDS = (3.40, 3.45, 3.50, 3.55, 3.60, 3.65)
+
+
+class TelemetryHistory:
+    def __init__(self, path=HISTORY_PATH, capacity=HISTORY_CAPACITY, min_spacing=HISTORY_MIN_SPACING):
+        size = HEADER.size + capacity * RECORD.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        magic, stored_capacity, self.head, self.count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or stored_capacity != capacity or self.head >= capacity or self.count > capacity:
+            self.head = self.count = 0
+            HEADER.pack_into(self.map, 0, MAGIC, capacity, 0, 0)
+        self.capacity = capacity
+        self.min_spacing = min_spacing
+        self.discharge_rate = None  # Percent per second, positive while discharging
+        self.estimate_at = None
+        self.update_estimate()
+
+    def __len__(self):
+        return self.count
+
+    def record(self, index):
+        return RECORD.unpack_from(self.map, HEADER.size + index * RECORD.size)
+
+    def latest(self):
+        if not self.count:
+            return None
+        return self.record((self.head - 1) % self.capacity)
+
+    def samples(self, since=None):
+        """Yield (timestamp, voltage, capacity) records, oldest first."""
+        start = (self.head - self.count) % self.capacity
+        for offset in range(self.count):
+            sample = self.record((start + offset) % self.capacity)
+            if since is None or sample[0] >= since:
+                yield sample
+
+    def append(self, timestamp, voltage, capacity):
+        """Store a sample unless the previous one is too recent. Returns True if stored.
+
+        A timestamp older than the newest record means the wall clock stepped
+        back, as after a reboot without an RTC. The sample is stored anyway
+        and the discharge estimate restarts from it.
+        """
+        latest = self.latest()
+        if latest is not None and 0 <= timestamp - latest[0] < self.min_spacing:
+            return False
+        RECORD.pack_into(self.map, HEADER.size + self.head * RECORD.size, timestamp, voltage, capacity)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        HEADER.pack_into(self.map, 0, MAGIC, self.capacity, self.head, self.count)
+        self.update_estimate()
+        return True
+
+    def update_estimate(self):
+        # Least-squares slope of capacity over the recent window, walking
+        # back from the newest record so only the window is touched. The
+        # window also ends where the clock stepped back between records.
+        self.discharge_rate = None
+        self.estimate_at = None
+        latest = self.latest()
+        if latest is None:
+            return
+        window = []
+        newer = latest[0]
+        for offset in range(1, self.count + 1):
+            sample = self.record((self.head - offset) % self.capacity)
+            if latest[0] - sample[0] > DISCHARGE_WINDOW or sample[0] > newer:
+                break
+            window.append(sample)
+            newer = sample[0]
+        if latest[0] - window[-1][0] < MIN_DISCHARGE_SPAN:
+            return
+        n = len(window)
+        mean_t = sum(sample[0] for sample in window) / n
+        mean_c = sum(sample[2] for sample in window) / n
+        covariance = sum((sample[0] - mean_t) * (sample[2] - mean_c) for sample in window)
+        variance = sum((sample[0] - mean_t) ** 2 for sample in window)
+        slope = covariance / variance
+        if slope >= 0:
+            return
+        self.discharge_rate = -slope
+        # Fitted capacity at the newest sample.
+        self.estimate_at = (latest[0], mean_c + slope * (latest[0] - mean_t))
+
+    def time_to_empty(self, now=None):
+        """Seconds until the fitted capacity reaches zero, or None if not discharging."""
+        if self.discharge_rate is None:
+            return None
+        timestamp, capacity = self.estimate_at
+        remaining = capacity / self.discharge_rate
+        if now is not None:
+            remaining -= now - timestamp
+        return max(0.0, remaining)
+
+    def close(self):
+        self.map.close()
+
+
+class LevelFilter:
+    """EMA-smoothed voltage bar that only changes level once past a margin.
+
+    A level boundary has to be crossed by more than hysteresis volts before
+    the bar moves, so noise around a threshold cannot make it flicker.
+    """
+
+    def __init__(self, alpha=0.3, hysteresis=0.01, thresholds=VOLTAGE_THRESHOLDS):
+        self.alpha = alpha
+        self.hysteresis = hysteresis
+        self.thresholds = thresholds
+        self.voltage = None
+        self.level = None
+
+    def update(self, voltage):
+        if self.voltage is None:
+            self.voltage = voltage
+            self.level = sum(1 for threshold in self.thresholds if voltage > threshold)
+        else:
+            self.voltage += self.alpha * (voltage - self.voltage)
+            level_up = sum(1 for threshold in self.thresholds if self.voltage > threshold + self.hysteresis)
+            level_down = sum(1 for threshold in self.thresholds if self.voltage > threshold - self.hysteresis)
+            if level_up > self.level:
+                self.level = level_up
+            elif level_down < self.level:
+                self.level = level_down
+        return VOLTAGE_LEVELS[self.level]